@@ -0,0 +1,36 @@
+import os
+import errno
+import tempfile
+
+
+def write_atomic(fname, write, binary=False, dir_mode=0777):
+    """Write file through temporary one and rename, so concurrent
+    readers never see partially written file
+
+    File is created with 0600 mode, missing directory with dir_mode.
+    Used for caches, so errors are not raised, returns True on success
+
+    :param write: callable, writes content to file object passed
+    """
+    dirname = os.path.dirname(fname)
+    try:
+        os.makedirs(dirname, dir_mode)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            return False
+
+    try:
+        fd, tmp_name = tempfile.mkstemp(dir=dirname)
+    except OSError:
+        return False
+
+    try:
+        with os.fdopen(fd, 'wb' if binary else 'w') as tmp_fd:
+            write(tmp_fd)
+        os.rename(tmp_name, fname)
+    except Exception:
+        # unserializable data, full disk, etc. - just don't cache it
+        os.unlink(tmp_name)
+        return False
+
+    return True
@@ -0,0 +1,498 @@
+"""
+Client-side benchmarks
+
+usage: python bench.py [benchmark_name ...]
+
+Results are printed as JSON, scalable benchmarks are run on synthetic
+environments of each size from SCALES, times are in microseconds
+per call. Exit code is 1 if some benchmark failed its budget.
+"""
+import os
+import sys
+import time
+import json
+import copy
+import shutil
+import ctypes
+import logging
+import tempfile
+import threading
+import subprocess
+import BaseHTTPServer
+
+import type_check
+import fuel_rest_api
+import cert_script
+
+
+GB = 1024 * 1024 * 1024
+
+# count of nodes in synthetic environment
+SCALES = (10, 100, 1000)
+
+NODE_ROLES = (['controller'], ['compute'], ['compute', 'cinder'],
+              ['ceph-osd'])
+
+
+def make_node_descr(node_id, cluster=None):
+    """Synthetic node description, similar to api/nodes element"""
+    disks = [{'name': 'sd' + chr(ord('a') + pos),
+              'model': 'ST1000NM0033-9ZM',
+              'disk': 'disk/by-path/pci-0000:00:1f.2-scsi-{}:0:0:0'
+                      .format(pos),
+              'extra': ['disk/by-id/wwn-0x5000c500{:08x}'.format(pos)],
+              'size': 1000 * GB,
+              'removable': '0'}
+             for pos in range(6)]
+
+    interfaces = [{'name': 'eth{}'.format(pos),
+                   'mac': '52:54:00:{:02x}:{:02x}:{:02x}'.format(
+                       node_id // 256, node_id % 256, pos),
+                   'max_speed': 10000,
+                   'current_speed': 10000,
+                   'driver': 'ixgbe',
+                   'bus_info': '0000:0{}:00.0'.format(pos),
+                   'pxe': pos == 0,
+                   'offloading_modes': [{'name': name, 'state': None,
+                                         'sub': []}
+                                        for name in ('rx-checksumming',
+                                                     'tx-checksumming',
+                                                     'scatter-gather',
+                                                     'generic-receive')]}
+                  for pos in range(4)]
+
+    return {'id': node_id,
+            'name': 'node-{}'.format(node_id),
+            'mac': interfaces[0]['mac'],
+            'ip': '10.20.0.{}'.format(node_id % 250 + 3),
+            'cluster': cluster,
+            'status': 'discover',
+            'online': True,
+            'roles': NODE_ROLES[node_id % len(NODE_ROLES)],
+            'pending_roles': [],
+            'pending_addition': False,
+            'pending_deletion': False,
+            'manufacturer': 'Supermicro',
+            'platform_name': 'X9DRW',
+            'kernel_params': None,
+            'os_platform': 'ubuntu',
+            'network_data': [{'name': 'public', 'dev': 'eth1',
+                              'ip': '172.16.0.{}/24'.format(node_id % 250),
+                              'gateway': '172.16.0.1', 'vlan': None,
+                              'netmask': '255.255.255.0',
+                              'brd': '172.16.0.255'}],
+            'meta': {'cpu': {'total': 8 * (1 + node_id % 4), 'real': 2,
+                             'spec': [{'model': 'Intel(R) Xeon(R) E5-2620',
+                                       'frequency': 2000}] * 24},
+                     'memory': {'total': (32 << node_id % 3) * GB,
+                                'maximum_capacity': 256 * GB,
+                                'slots': 16,
+                                'devices': [{'type': 'DDR3', 'size': 8 * GB,
+                                             'frequency': 1333}] * 16},
+                     'disks': disks,
+                     'interfaces': interfaces,
+                     'system': {'serial': 'S{:08d}'.format(node_id),
+                                'manufacturer': 'Supermicro',
+                                'product': 'X9DRW', 'version': '0123456789',
+                                'uuid': '00000000-0000-0000-0000-{:012d}'
+                                        .format(node_id),
+                                'family': 'To be filled by O.E.M.',
+                                'fqdn': 'node-{}.domain.tld'
+                                        .format(node_id)},
+                     'numa_topology': {'numa_nodes': [
+                         {'id': numa_id, 'memory': 64 * GB,
+                          'cpus': range(numa_id * 12, numa_id * 12 + 12)}
+                         for numa_id in range(2)]}}}
+
+
+def has_instance_dict(obj):
+    """Check __dict__ presence without creating it (reading
+    obj.__dict__ allocates empty dict for objects with slots)
+    """
+    offset = type(obj).__dictoffset__
+    if offset == 0:
+        return False
+    return ctypes.c_void_p.from_address(id(obj) + offset).value is not None
+
+
+def deep_sizeof(obj, seen=None):
+    """Approximate memory, used by object and everything it references"""
+    if seen is None:
+        seen = set()
+
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, val in obj.items():
+            size += deep_sizeof(key, seen) + deep_sizeof(val, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for val in obj:
+            size += deep_sizeof(val, seen)
+    elif hasattr(obj, '__dict__') or hasattr(obj, '__slots__'):
+        for cls in type(obj).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if hasattr(obj, name):
+                    size += deep_sizeof(getattr(obj, name), seen)
+        if has_instance_dict(obj):
+            size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+def bench_node_memory(count=1000):
+    """Memory per node for Node, CompactNode and projected Node"""
+    descrs = [make_node_descr(node_id) for node_id in range(count)]
+    fields = ('mac', 'roles', 'pending_roles', 'cluster')
+
+    variants = {
+        'node': [fuel_rest_api.Node(None, **copy.deepcopy(descr))
+                 for descr in descrs],
+        'compact_node': [fuel_rest_api.CompactNode(None,
+                                                   **copy.deepcopy(descr))
+                         for descr in descrs],
+        'projected_node': [
+            fuel_rest_api.Node(None, **fuel_rest_api.project(descr, fields))
+            for descr in descrs],
+        'projected_compact_node': [
+            fuel_rest_api.CompactNode(None,
+                                      **fuel_rest_api.project(descr, fields))
+            for descr in descrs],
+    }
+
+    res = {'count': count}
+    for name, nodes in variants.items():
+        res[name + '_bytes'] = deep_sizeof(nodes) // count
+    return res
+
+
+class NullConnection(object):
+    """Connection, which does nothing, to measure client overhead"""
+
+    def do(self, method, path, params=None):
+        return None
+
+
+def legacy_make_call(method, url):
+    """make_call before routes were compiled, as baseline
+    (without payload printing)
+    """
+    def closure(obj, entire_obj=None, **data):
+        inline_params_vals = {}
+        for name in fuel_rest_api.get_inline_param_list(url):
+            if name in data:
+                inline_params_vals[name] = data[name]
+                del data[name]
+            else:
+                inline_params_vals[name] = getattr(obj, name)
+        result_url = url.format(**inline_params_vals)
+
+        if entire_obj is not None:
+            if data != {}:
+                raise ValueError("Both entire_obj and data provided")
+            data = entire_obj
+
+        return obj.__connection__.do(method, result_url, params=data)
+    return closure
+
+
+def timeit(func, count):
+    """Returns mean time of func() call in microseconds,
+    first call is not measured to exclude caches warmup
+    """
+    func()
+    stime = time.time()
+    for _ in xrange(count):
+        func()
+    return (time.time() - stime) / count * 1E6
+
+
+def bench_make_call(count=100000):
+    """Per-call overhead of GET descriptor with two url params"""
+    url = 'api/clusters/{id}/network_configuration/{net_provider}'
+
+    cluster = fuel_rest_api.Cluster(NullConnection(), id=1,
+                                    net_provider='neutron')
+    legacy = legacy_make_call('get', url)
+    compiled = fuel_rest_api.make_call('get', url)
+    # don't register benchmark route in client's route table
+    fuel_rest_api.route_table.remove(compiled.route)
+
+    return {'count': count,
+            'legacy_us': timeit(lambda: legacy(cluster), count),
+            'compiled_us': timeit(lambda: compiled(cluster), count)}
+
+
+# modules, which must not be imported by CLI startup
+LAZY_MODULES = ('keystoneclient', 'netaddr', 'smtplib', 'email.mime',
+                'yaml', 'multiprocessing')
+
+# startup budget in milliseconds, measured from interpreter start
+STARTUP_BUDGET = {'import_ms': 250, 'first_request_ms': 400}
+
+STARTUP_SCRIPT = """
+import time
+stime = time.time()
+import sys
+import json
+import main
+import_time = time.time()
+conn = main.fuel_rest_api.Urllib2HTTP(sys.argv[1])
+conn.get('/api/version')
+request_time = time.time()
+print json.dumps({'import_ms': (import_time - stime) * 1000,
+                  'first_request_ms': (request_time - stime) * 1000,
+                  'modules': sorted(sys.modules)})
+"""
+
+
+class VersionHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = '{"release": "bench"}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def run_startup_once(url):
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    stime = time.time()
+    out = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT,
+                                   url], cwd=cwd)
+    res = json.loads(out.strip().split('\n')[-1])
+    res['process_ms'] = (time.time() - stime) * 1000
+    return res
+
+
+def bench_startup(count=5):
+    """CLI import time and time to first request, median of count runs
+
+    Warm yaml cache is assumed, first run is used to fill it
+    """
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), VersionHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        url = "http://127.0.0.1:{}/".format(server.server_address[1])
+        run_startup_once(url)
+        runs = [run_startup_once(url) for _ in range(count)]
+    finally:
+        server.shutdown()
+
+    res = {'count': count, 'budget': STARTUP_BUDGET}
+    for name in ('import_ms', 'first_request_ms', 'process_ms'):
+        res[name] = sorted(run[name] for run in runs)[count // 2]
+
+    res['eager_modules'] = sorted(
+        set(name for name in runs[0]['modules']
+            for lazy_name in LAZY_MODULES
+            if name == lazy_name or name.startswith(lazy_name + '.')))
+
+    res['failed'] = bool(res['eager_modules']) or \
+        any(res[name] > limit for name, limit in STARTUP_BUDGET.items())
+    return res
+
+
+def repeats(scale):
+    """Count of repeats to keep each measurement about equally long"""
+    return max(3, 10000 // scale)
+
+
+def make_nodes(count, conn=None):
+    return [fuel_rest_api.Node(conn, **make_node_descr(node_id))
+            for node_id in range(1, count + 1)]
+
+
+def make_saved_config(count):
+    """Synthetic config, as returned by load_config_from_fuel"""
+    nodes = {}
+    for node_id in range(1, count + 1):
+        descr = make_node_descr(node_id)
+        nodes[u'node{}'.format(node_id)] = {
+            u'network_data': [dict((unicode(key), val)
+                                   for key, val in net.items())
+                              for net in descr['network_data']],
+            u'main_mac': unicode(descr['mac'])}
+
+    networks = [{u'id': net_id, u'name': name, u'vlan_start': None,
+                 u'cidr': u'192.168.{}.0/24'.format(net_id),
+                 u'gateway': None, u'meta': {u'notation': u'cidr'}}
+                for net_id, name in enumerate([u'public', u'management',
+                                               u'storage', u'fixed',
+                                               u'fuelweb_admin'])]
+
+    return {u'name': u'bench', u'deployment_mode': u'ha_compact',
+            u'release': 1, u'settings': {u'net_provider': u'neutron'},
+            u'nodes': nodes, u'timeout': 3600,
+            u'network_provider_configuration': {u'networks': networks}}
+
+
+def make_cluster_template(count):
+    nodes = {}
+    for node_id in range(1, count + 1):
+        nodes['node{}'.format(node_id)] = {
+            'roles': NODE_ROLES[node_id % len(NODE_ROLES)],
+            'requirements': {'cpu_count_min': 8, 'mem_count_min': 32},
+            'interfaces': {'eth0': {'networks': ['fuelweb_admin']},
+                           'eth1': {'networks': ['public', 'management']}}}
+    return {'name': 'bench', 'release': 1,
+            'settings': {'net_provider': 'neutron'}, 'nodes': nodes}
+
+
+def make_requirements(count):
+    """Descriptions for nodes matching, as in cluster templates"""
+    return dict(('node{}'.format(pos),
+                 {'requirements': {'cpu_count_min': 8 * (1 + pos % 4),
+                                   'mem_count_min': 32,
+                                   'hd_size_min': 1000}})
+                for pos in range(count))
+
+
+class NodesConnection(NullConnection):
+    """Connection, which returns same nodes on each api/nodes call"""
+
+    def __init__(self, descrs):
+        self.descrs = descrs
+
+    def get(self, path):
+        return self.descrs
+
+
+def per_scale(func):
+    """Run func(scale) for each scale, results are keyed by scale"""
+    return dict((str(scale), func(scale)) for scale in SCALES)
+
+
+def bench_rest_obj():
+    """Node objects construction from API descriptions"""
+    def run(scale):
+        descrs = [make_node_descr(node_id) for node_id in range(scale)]
+
+        def construct():
+            return [fuel_rest_api.Node(None, **descr) for descr in descrs]
+
+        return {'us': timeit(construct, repeats(scale))}
+    return per_scale(run)
+
+
+def bench_node_list():
+    """NodeList filtering by role"""
+    def run(scale):
+        nodes = fuel_rest_api.NodeList(make_nodes(scale))
+
+        def filter_roles():
+            return nodes.controller, nodes.compute, nodes.cinder
+
+        return {'us': timeit(filter_roles, repeats(scale))}
+    return per_scale(run)
+
+
+def bench_match():
+    """find_node_by_requirements and match_nodes among scale free nodes"""
+    logger = logging.getLogger('bench')
+    logger.addHandler(logging.NullHandler())
+    cert_script.set_logger(logger)
+
+    def run(scale):
+        nodes = make_nodes(scale)
+        conn = NodesConnection([make_node_descr(node_id)
+                                for node_id in range(1, scale + 1)])
+        descriptions = make_requirements(min(10, scale // 2))
+        requirements = {'cpu_count_min': 24, 'mem_count_min': 64}
+
+        def find():
+            return cert_script.find_node_by_requirements(nodes,
+                                                         requirements)
+
+        def match():
+            return cert_script.match_nodes(conn, descriptions, 10)
+
+        return {'find_node_us': timeit(find, repeats(scale)),
+                'match_nodes_us': timeit(match, repeats(scale)),
+                'descriptions': len(descriptions)}
+    return per_scale(run)
+
+
+def bench_type_check():
+    """type_check.check for interfaces mapping and cluster template"""
+    def run(scale):
+        mapping = dict(('eth{}'.format(pos), ['public', 'management'])
+                       for pos in range(scale))
+        template = make_cluster_template(scale)
+
+        def check_mapping():
+            type_check.check({str: [str]}, mapping)
+
+        def check_template():
+            cert_script.validate_cluster_template(template)
+
+        return {'mapping_us': timeit(check_mapping, repeats(scale)),
+                'template_us': timeit(check_template, repeats(scale))}
+    return per_scale(run)
+
+
+def bench_encode():
+    """encode_recursivelly on saved config"""
+    def run(scale):
+        config = make_saved_config(scale)
+        return {'us': timeit(lambda: cert_script.encode_recursivelly(config),
+                             repeats(scale))}
+    return per_scale(run)
+
+
+def bench_yaml():
+    """store_config and load_config of saved config"""
+    tmp_dir = tempfile.mkdtemp()
+    fname = os.path.join(tmp_dir, 'config.yaml')
+
+    def run(scale):
+        config = cert_script.encode_recursivelly(make_saved_config(scale))
+        count = max(3, repeats(scale) // 10)
+        dump_us = timeit(lambda: cert_script.store_config(config, fname),
+                         count)
+        return {'dump_us': dump_us,
+                'load_us': timeit(lambda: cert_script.load_config(fname),
+                                  count),
+                'bytes': os.path.getsize(fname)}
+
+    try:
+        return per_scale(run)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+BENCHMARKS = {
+    'node_memory': bench_node_memory,
+    'make_call': bench_make_call,
+    'startup': bench_startup,
+    'rest_obj': bench_rest_obj,
+    'node_list': bench_node_list,
+    'match': bench_match,
+    'type_check': bench_type_check,
+    'encode': bench_encode,
+    'yaml': bench_yaml,
+}
+
+
+def main(argv):
+    names = argv[1:] or sorted(BENCHMARKS)
+    results = {}
+    for name in names:
+        results[name] = BENCHMARKS[name]()
+    results['python'] = sys.version.split()[0]
+    print json.dumps(results, indent=4, sort_keys=True)
+    if any(res.get('failed') for res in results.values()
+           if isinstance(res, dict)):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main(sys.argv))
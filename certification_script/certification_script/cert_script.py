@@ -1,18 +1,22 @@
-import time
 import glob
+import time
+import bisect
 import pprint
 import os.path
 import pkgutil
-import smtplib
 import inspect
 import functools
+import threading
 import contextlib
-from email.mime.text import MIMEText
-
-import yaml
+import collections
 
+import polling
+import metrics
+import type_check
+import yaml_cache
 import fuel_rest_api
 from tests import base
+from type_check import Struct, Any
 
 
 logger = None
@@ -23,85 +27,202 @@ def set_logger(log):
     logger = log
 
 
+GB = 1024 * 1024 * 1024
+TOO_LARGE_NUMBER = 1000 ** 3
+
+
+NodeCapacity = collections.namedtuple('NodeCapacity', 'cpu mem hd node')
+
+
+def get_node_capacity(node):
+    """Returns NodeCapacity, memory and disks are in GB"""
+    meta = node.meta
+    cpu = meta['cpu']['total']
+    mem = meta['memory']['total'] / GB
+    hd = sum(disk['size'] for disk in meta['disks']) / GB
+    return NodeCapacity(cpu, mem, hd, node)
+
+
+def parse_requirements(requirements):
+    """Returns ((min_cpu, max_cpu), (min_mem, max_mem), (min_hd, max_hd))"""
+    return ((requirements.get('cpu_count_min', 0),
+             requirements.get('cpu_count_max', TOO_LARGE_NUMBER)),
+            (requirements.get('mem_count_min', 0),
+             requirements.get('mem_count_max', TOO_LARGE_NUMBER)),
+            (requirements.get('hd_size_min', 0),
+             requirements.get('hd_size_max', TOO_LARGE_NUMBER)))
+
+
+class CapacityIndex(object):
+    """Nodes, sorted by capacity, smallest first
+
+    :param nodes: nodes to index
+    :param cache: dict node id -> NodeCapacity, shared between indexes
+                  to avoid recalculation
+    """
+
+    def __init__(self, nodes, cache=None):
+        self.nodes = list(nodes)
+        self.cache = cache if cache is not None else {}
+        self.capacities = None
+        self.cpus = None
+        self.by_mac = dict((node.mac.upper(), node) for node in self.nodes)
+
+    def get_capacities(self):
+        """Capacities are calculated on first requirements lookup, so
+        nodes without full hardware meta can be matched by mac
+        """
+        if self.capacities is None:
+            capacities = []
+            for node in self.nodes:
+                # each poll makes new Node objects, hardware stays same
+                capacity = self.cache.get(node.id)
+                if capacity is None:
+                    capacity = self.cache[node.id] = get_node_capacity(node)
+                elif capacity.node is not node:
+                    capacity = capacity._replace(node=node)
+                capacities.append(capacity)
+
+            capacities.sort(key=lambda capacity: capacity[:3])
+            self.capacities = capacities
+            self.cpus = [capacity.cpu for capacity in capacities]
+        return self.capacities
+
+    def find(self, requirements):
+        """Returns all nodes, which fit requirements, smallest first"""
+        (min_cpu, max_cpu), (min_mem, max_mem), (min_hd, max_hd) = \
+            parse_requirements(requirements)
+
+        capacities = self.get_capacities()
+        begin = bisect.bisect_left(self.cpus, min_cpu)
+        end = bisect.bisect_right(self.cpus, max_cpu)
+        return [capacity.node for capacity in capacities[begin:end]
+                if max_mem >= capacity.mem >= min_mem and
+                max_hd >= capacity.hd >= min_hd]
+
+    def candidates(self, node_description):
+        """Returns nodes, suitable for node description"""
+        node_mac = node_description.get('mac')
+        if node_mac is not None:
+            node = self.by_mac.get(node_mac.upper())
+            return [] if node is None else [node]
+        elif 'requirements' in node_description:
+            return self.find(node_description['requirements'])
+        return list(self.nodes)
+
+
 def find_node_by_requirements(nodes, requirements):
-    GB = 1024 * 1024 * 1024
-    TOO_LARGE_NUMBER = 1000 ** 3
-    
-    min_cpu = requirements.get('cpu_count_min', 0)
-    max_cpu = requirements.get('cpu_count_max', TOO_LARGE_NUMBER)
-    
-    min_hd = requirements.get('hd_size_min', 0)
-    max_hd = requirements.get('hd_size_max', TOO_LARGE_NUMBER)
+    """Returns smallest node, which fits requirements, or None"""
+    found = CapacityIndex(nodes).find(requirements)
+    return found[0] if found else None
+
+
+def assign_nodes(index, nodes_descriptions):
+    """Find node for each description, different for all descriptions
+
+    Uses augmenting paths (Kuhn's algorithm), so assignment is found
+    if it exists. Descriptions with fewest candidates are matched first
+    and candidates are tried smallest first to keep big nodes free.
+
+    Returns (assignment, unmatched), assignment maps description name
+    to node, unmatched lists names of descriptions without node
+    """
+    candidates = dict((name, index.candidates(descr))
+                      for name, descr in nodes_descriptions.items())
+    order = sorted(candidates, key=lambda name: len(candidates[name]))
 
-    min_mem = requirements.get('mem_count_min', 0)
-    max_mem = requirements.get('mem_count_max', TOO_LARGE_NUMBER)
+    owner = {}
 
-    def hd_valid(hd):
-        return max_hd >= hd >= min_hd
+    def try_assign(name, visited):
+        for node in candidates[name]:
+            if node.id in visited:
+                continue
+            visited.add(node.id)
+            if node.id not in owner or try_assign(owner[node.id], visited):
+                owner[node.id] = name
+                return True
+        return False
 
-    def cpu_valid(cpu):
-        return max_cpu >= cpu >= min_cpu
+    unmatched = [name for name in order if not try_assign(name, set())]
 
-    def mem_valid(mem):
-        return max_mem >= mem >= min_mem
+    nodes = dict((node.id, node) for name in candidates
+                 for node in candidates[name])
+    assignment = dict((name, nodes[node_id])
+                      for node_id, name in owner.items())
+    return assignment, unmatched
 
-    for node in nodes:
-        cpu = node.meta['cpu']['total']
-        mem = node.meta['memory']['total'] / GB
-        hd = sum(disk['size'] for disk in node.meta['disks']) / GB
 
-        if cpu_valid(cpu) and hd_valid(hd) and mem_valid(mem):
-            return node
-    return None
+class NodeReservations(object):
+    """Free nodes, already matched by concurrent deployments,
+    but not yet added to their clusters
+    """
 
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reserved = set()
+
+    def release(self, nodes):
+        with self.lock:
+            self.reserved.difference_update(node.id for node in nodes)
+
+
+def match_nodes(conn, nodes_descriptions, timeout, reservations=None):
+    """Wait until free nodes for all descriptions are discovered
+
+    Returns list of (node description, node). If reservations is given,
+    reserved nodes are skipped and matched nodes are reserved, caller
+    should release them after adding to cluster.
+    """
+    if reservations is None:
+        reservations = NodeReservations()
 
-def match_nodes(conn, nodes_descriptions, timeout):
     required_nodes_count = len(nodes_descriptions)
     msg = "Waiting for nodes {} to be discovered...".\
         format(required_nodes_count)
 
     logger.debug(msg)
     result = []
+    capacity_cache = {}
+
+    def nodes_matched():
+        all_nodes = list(fuel_rest_api.get_all_nodes(conn))
+
+        with reservations.lock:
+            free_nodes = [node for node in all_nodes
+                          if node.cluster is None and
+                          node.id not in reservations.reserved]
+
+            if len(free_nodes) < required_nodes_count:
+                return False
+
+            index = CapacityIndex(free_nodes, capacity_cache)
+            assignment, unmatched = assign_nodes(index, nodes_descriptions)
 
-    for _ in range(timeout):
-        free_nodes = [node for node in fuel_rest_api.get_all_nodes(conn)
-                      if node.cluster is None]
-
-        if len(free_nodes) >= required_nodes_count:
-            node_mac_mapping = dict([(node.mac.upper(), node) for
-                                     node in free_nodes])
-            for node_description in nodes_descriptions.values():
-                found_node = None
-                node_mac = node_description.get('mac')
-                if node_mac is not None:
-                    node_mac = node_mac.upper()
-                    if node_mac in node_mac_mapping:
-                        found_node = node_mac_mapping[node_mac]
-                elif 'requirements' in node_description:
-                    found_node = find_node_by_requirements(
-                        free_nodes, node_description['requirements'])
-                else:
-                    found_node = free_nodes[0]
-
-                if found_node is None:
-                    if node_mac is not None:
-                        msg_templ = "Can't found node for requirements: mac={}, {}"
-                        msg = msg_templ.format(node_mac,
-                                         node_description.get('requirements'))
-                    else:
-                        msg_templ = "Can't found node for requirements: {}"
-                        msg = msg_templ.format(node_description.get('requirements'))
-
-                    logger.error(msg)
-                    break
-
-                free_nodes.remove(found_node)
-                result.append((node_description, found_node))
+            if not unmatched:
+                reservations.reserved.update(node.id for node
+                                             in assignment.values())
+
+        for name in unmatched:
+            node_description = nodes_descriptions[name]
+            node_mac = node_description.get('mac')
+            if node_mac is not None:
+                msg_templ = "Can't found node for requirements: mac={}, {}"
+                msg = msg_templ.format(node_mac,
+                                       node_description.get('requirements'))
             else:
-                return result
-        time.sleep(1)
+                msg_templ = "Can't found node for requirements: {}"
+                msg = msg_templ.format(node_description.get('requirements'))
+            logger.error(msg)
+
+        if unmatched:
+            return False
+
+        for name, node_description in nodes_descriptions.items():
+            result.append((node_description, assignment[name]))
+        return True
 
-    raise Exception('Timeout exception')
+    polling.wait(nodes_matched, timeout, "nodes discovery", 'discovery')
+    return result
 
 
 def find_test_classes():
@@ -115,19 +236,27 @@ def find_test_classes():
     return test_classes
 
 
-def run_all_tests(conn, cluster_id, timeout, tests_to_run):
+def run_all_tests(conn, cluster_id, timeout, tests_to_run, options=None):
+    """Run tests with all test classes
+
+    :param options: dict of options, passed to test classes
+    """
     test_classes = find_test_classes()
     print test_classes
     results = []
-    for test_class in test_classes:
-        test_class_inst = test_class(conn, cluster_id, timeout)
-        available_tests = test_class_inst.get_available_tests()
-        results.extend(test_class_inst.run_tests(
-            set(available_tests) & set(tests_to_run)))
+    with metrics.phase('tests'):
+        for test_class in test_classes:
+            test_class_inst = test_class(conn, cluster_id, timeout, options)
+            available_tests = test_class_inst.get_available_tests()
+            results.extend(test_class_inst.run_tests(
+                set(available_tests) & set(tests_to_run)))
     return results
 
 
 def send_results(mail_config, tests):
+    import smtplib
+    from email.mime.text import MIMEText
+
     server = smtplib.SMTP(mail_config['smtp_server'], 587)
     server.starttls()
     server.login(mail_config['login'], mail_config['password'])
@@ -149,80 +278,266 @@ def send_results(mail_config, tests):
     server.quit()
 
 
-def load_all_clusters(path):
-    res = {}
-    for fname in glob.glob(os.path.join(path, "*.yaml")):
+node_template_descr = Struct(
+    {'roles': [basestring]},
+    {'mac': basestring,
+     'dns_name': basestring,
+     'requirements': {basestring: int},
+     'interfaces': {basestring: Struct({'networks': [basestring]})}})
+
+
+cluster_template_descr = Struct(
+    {'name': basestring,
+     'release': int,
+     'settings': {basestring: Any},
+     'nodes': {basestring: node_template_descr}},
+    {'deployment_mode': basestring,
+     'network_configuration': {basestring: Any},
+     'nodes_discovery_timeout': int,
+     'DEPLOY_TIMEOUT': int,
+     'timeout': int})
+
+
+def validate_cluster_template(cluster):
+    """Raise type_check.CheckError, if cluster template is invalid"""
+    type_check.check(cluster_template_descr, cluster)
+
+
+class TemplateLoader(object):
+    """Lazily loads cluster templates from directory by name
+
+    Template 'name' is looked up in name.yaml first, other files
+    are parsed only if it isn't there
+    """
+
+    def __init__(self, path, cache=None):
+        self.path = path
+        self.cache = cache
+        self.templates = {}
+        self.loaded_files = set()
+        # file name -> error, for files which failed to load
+        self.errors = {}
+
+    def load_file(self, fname):
+        if fname in self.loaded_files:
+            return None
+        self.loaded_files.add(fname)
+
         try:
-            cluster = yaml.load(open(fname).read())
-            res[cluster['name']] = cluster
+            if self.cache is not None:
+                cluster = self.cache.load(fname)
+            else:
+                cluster = yaml_cache.load_yaml_file(fname)
+            validate_cluster_template(cluster)
         except Exception as exc:
             msg = "Failed to load cluster from file {}: {}".format(
                 fname, exc)
             logger.error(msg)
-    return res
+            self.errors[fname] = exc
+            return None
+
+        self.templates.setdefault(cluster['name'], cluster)
+        return cluster
+
+    def get(self, name, default=None):
+        fname = os.path.join(self.path, name + ".yaml")
+        if name not in self.templates and os.path.exists(fname):
+            self.load_file(fname)
+
+        for fname in sorted(glob.glob(os.path.join(self.path, "*.yaml"))):
+            if name in self.templates:
+                break
+            self.load_file(fname)
+
+        return self.templates.get(name, default)
+
+    def __getitem__(self, name):
+        cluster = self.get(name)
+        if cluster is None:
+            raise KeyError(name)
+        return cluster
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def require(self, names):
+        """Returns dict name -> template for all names
+
+        Raises ValueError, listing missing templates and files, which
+        failed to load, if any of templates is not found
+        """
+        res = {}
+        missing = []
+        for name in names:
+            cluster = self.get(name) if name is not None else None
+            if cluster is None:
+                missing.append(name)
+            else:
+                res[name] = cluster
+
+        if missing:
+            msg = "Cluster templates not found: {}".format(
+                ", ".join(sorted(set(map(str, missing)))))
+            if self.errors:
+                msg += "; invalid files: " + "; ".join(
+                    "{}: {}".format(fname, exc)
+                    for fname, exc in sorted(self.errors.items()))
+            raise ValueError(msg)
+
+        return res
 
+    def load_all(self):
+        for fname in sorted(glob.glob(os.path.join(self.path, "*.yaml"))):
+            self.load_file(fname)
+        return dict(self.templates)
 
-def deploy_cluster(conn, cluster_desc, additional_cfg=None):
-    cluster = fuel_rest_api.create_empty_cluster(conn, cluster_desc)
 
-    if 'network_configuration' in cluster_desc:
-        cluster.set_networks(cluster_desc['network_configuration'])
+def load_all_clusters(path, cache=None):
+    return TemplateLoader(path, cache).load_all()
+
+
+def deploy_cluster(conn, cluster_desc, additional_cfg=None,
+                   reservations=None):
+    with metrics.phase('create_cluster'):
+        cluster = fuel_rest_api.create_empty_cluster(conn, cluster_desc)
+
+        if 'network_configuration' in cluster_desc:
+            # written together with saved config networks, if any
+            cluster.set_networks(cluster_desc['network_configuration'],
+                                 flush=False)
 
     nodes_discover_timeout = cluster_desc.get('nodes_discovery_timeout', 3600)
     deploy_timeout = cluster_desc.get('DEPLOY_TIMEOUT', 3600)
     nodes_info = cluster_desc['nodes']
 
-    for node_desc, node in match_nodes(conn, nodes_info,
-                                       nodes_discover_timeout):
-        if 'interfaces' in node_desc:
-            cluster.add_node(node, node_desc['roles'], node_desc['interfaces'])
-        else:
-            cluster.add_node(node, node_desc['roles'])
-
-    if additional_cfg is not None:
-        # TODO: update network from this call 
-        # can be merged with cluster.set_networks above
-        update_cluster(cluster, additional_cfg)
+    nodes_descr = []
+    with metrics.phase('discovery'):
+        for node_desc, node in match_nodes(conn, nodes_info,
+                                           nodes_discover_timeout,
+                                           reservations):
+            nodes_descr.append((node, node_desc['roles'],
+                                node_desc.get('interfaces')))
 
-    cluster.deploy(deploy_timeout)
+    try:
+        with metrics.phase('add_nodes'):
+            cluster.add_nodes(nodes_descr)
+    finally:
+        if reservations is not None:
+            reservations.release(node for node, _, _ in nodes_descr)
+
+    with metrics.phase('update_cluster'):
+        if additional_cfg is not None:
+            update_cluster(cluster, additional_cfg, flush=False)
+        cluster.flush_networks()
+
+    with metrics.phase('deploy'):
+        cluster.deploy(deploy_timeout)
     return cluster
 
 
+class ClusterWaiter(object):
+    """Shares single clusters list request between concurrent waits"""
+
+    def __init__(self, conn, max_age):
+        self.conn = conn
+        self.max_age = max_age
+        self.ids = None
+        self.update_time = 0
+
+    def exists(self, cluster_id):
+        if time.time() - self.update_time > self.max_age:
+            self.ids = set(cluster['id']
+                           for cluster in self.conn.get('api/clusters'))
+            self.update_time = time.time()
+        return cluster_id in self.ids
+
+
+def delete_clusters(conn, clusters, concurrency=None, timeout=60):
+    """Delete clusters and wait until all of them disappear
+
+    DELETE requests for up to concurrency clusters (all, if None) are
+    issued at once, next cluster deletion starts as soon as one
+    finishes. All deletions are tracked in single polling loop.
+
+    Returns dict cluster name -> None or exception, if deletion failed
+    """
+    pending = list(clusters)
+    if concurrency is None:
+        concurrency = max(len(pending), 1)
+
+    outcomes = {}
+    poller = polling.Poller()
+    policy = polling.get_policy('delete')
+    waiter = ClusterWaiter(conn, policy.min_interval / 2.0)
+
+    def on_finished(task):
+        outcomes[task.cluster.name] = task.error
+        if pending:
+            start(pending.pop(0))
+
+    def start(cluster):
+        try:
+            cluster.delete()
+        except Exception as exc:
+            outcomes[cluster.name] = exc
+            if pending:
+                start(pending.pop(0))
+            return
+
+        task = poller.add(lambda: not waiter.exists(cluster.id), timeout,
+                          "cluster {} deletion".format(cluster.name),
+                          policy, on_finished)
+        task.cluster = cluster
+
+    for _ in range(min(concurrency, len(pending))):
+        if pending:
+            start(pending.pop(0))
+
+    poller.run()
+
+    for name, error in sorted(outcomes.items()):
+        if error is None:
+            logger.info("Cluster {} deleted".format(name))
+        else:
+            logger.error("Failed to delete cluster {}: {}".format(name,
+                                                                  error))
+    return outcomes
+
+
 def delete_if_exists(conn, name):
-    for cluster_obj in fuel_rest_api.get_all_clusters(conn):
-        if cluster_obj.name == name:
-            cluster_obj.delete()
-            wd = fuel_rest_api.with_timeout(60, "Wait cluster deleted")
-            wd(lambda co: not co.check_exists())(cluster_obj)
+    clusters = [cluster_obj
+                for cluster_obj in fuel_rest_api.get_all_clusters(conn)
+                if cluster_obj.name == name]
+    for error in delete_clusters(conn, clusters).values():
+        if error is not None:
+            raise error
 
 
-def delete_all_clusters(conn):
-    for cluster_obj in fuel_rest_api.get_all_clusters(conn):
-        cluster_obj.delete()
-        wd = fuel_rest_api.with_timeout(60, "Wait cluster deleted")
-        wd(lambda co: not co.check_exists())(cluster_obj)
+def delete_all_clusters(conn, concurrency=None, timeout=60):
+    """Returns dict cluster name -> None or deletion error"""
+    clusters = fuel_rest_api.get_all_clusters(conn)
+    return delete_clusters(conn, clusters, concurrency, timeout)
 
 
 @contextlib.contextmanager
-def make_cluster(conn, cluster, auto_delete=False, debug=False, delete=True, additional_cfg=None):
+def make_cluster(conn, cluster, auto_delete=False, debug=False, delete=True,
+                 additional_cfg=None, reservations=None):
     if auto_delete:
-        for cluster_obj in fuel_rest_api.get_all_clusters(conn):
-            if cluster_obj.name == cluster['name']:
-                cluster_obj.delete()
-                wd = fuel_rest_api.with_timeout(60, "Wait cluster deleted")
-                wd(lambda co: not co.check_exists())(cluster_obj)
+        delete_if_exists(conn, cluster['name'])
 
-    c = deploy_cluster(conn, cluster, additional_cfg)
+    c = deploy_cluster(conn, cluster, additional_cfg, reservations)
     nodes = list(c.get_nodes())
     c.nodes = fuel_rest_api.NodeList(nodes)
     try:
         yield c
     except Exception as _:
         if not debug and delete:
-            c.delete()
+            with metrics.phase('delete'):
+                c.delete()
     else:
         if delete:
-            c.delete()
+            with metrics.phase('delete'):
+                c.delete()
 
 
 def with_cluster(template_name, tear_down=True, **params):
@@ -298,6 +613,8 @@ def load_config_from_fuel(conn, cluster_id):
 
 
 def store_config(config, file_name):
+    import yaml
+
     if not file_name.endswith('.yaml'):
         file_name += '.yaml'
 
@@ -306,14 +623,19 @@ def store_config(config, file_name):
 
 
 def load_config(file_name):
-    with open(file_name) as fd:
-        return yaml.load(fd.read())
+    return yaml_cache.load_yaml_file(file_name)
+
 
+def update_cluster(cluster, cfg, flush=True):
+    """Apply saved config to cluster
 
-def update_cluster(cluster, cfg):
+    :param flush: write network configuration now, else caller
+                  should call cluster.flush_networks
+    """
 
     cfg_for_mac = {val['main_mac']: val for name, val in cfg['nodes'].items()}
 
+    mappings = []
     for node in cluster.get_nodes():
         if node.mac in cfg_for_mac:
             node_cfg = cfg_for_mac[node.mac]
@@ -326,7 +648,90 @@ def update_cluster(cluster, cfg):
                 dev_name = net_descr['dev']
                 mapping.setdefault(dev_name, []).append(net_name)
 
-            node.set_network_assigment(mapping)
+            mappings.append((node, mapping))
+
+    if mappings:
+        cluster.set_network_assigments(mappings)
 
     net_data = cfg['network_provider_configuration']
-    cluster.set_networks(net_data)
+    cluster.set_networks(net_data, flush)
+
+
+def test():
+    class FakeNode(object):
+        def __init__(self, node_id, cpu=None, mem=1, hd=1):
+            self.id = node_id
+            self.mac = "aa:bb:cc:dd:ee:{:02x}".format(node_id)
+            # nodes without cpu have sparse meta
+            if cpu is not None:
+                self.meta = {'cpu': {'total': cpu},
+                             'memory': {'total': mem * GB},
+                             'disks': [{'size': hd * GB}]}
+            else:
+                self.meta = {}
+
+    class FixedIndex(object):
+        def candidates(self, node_description):
+            return node_description['candidates']
+
+    def names(assignment):
+        return dict((name, node.id) for name, node in assignment.items())
+
+    n1, n2, n3 = FakeNode(1), FakeNode(2), FakeNode(3)
+
+    # greedy in any order assigns n1 to a or b and then fails for c,
+    # augmenting path moves a and b to other nodes
+    descrs = {'a': {'candidates': [n1, n2]},
+              'b': {'candidates': [n2, n3]},
+              'c': {'candidates': [n1, n2]}}
+    assignment, unmatched = assign_nodes(FixedIndex(), descrs)
+    assert unmatched == []
+    assert len(set(names(assignment).values())) == 3
+    for name, node in assignment.items():
+        assert node in descrs[name]['candidates']
+
+    # three descriptions can't share two nodes
+    descrs = {'a': {'candidates': [n1, n2]},
+              'b': {'candidates': [n1, n2]},
+              'c': {'candidates': [n1, n2]}}
+    assignment, unmatched = assign_nodes(FixedIndex(), descrs)
+    assert len(unmatched) == 1 and len(assignment) == 2
+
+    small, big = FakeNode(10, cpu=2, mem=4), FakeNode(11, cpu=8, mem=64)
+    sparse = FakeNode(12)
+
+    # mac pinned description takes its node, matching by mac doesn't
+    # need hardware meta
+    index = CapacityIndex([small, big, sparse])
+    assignment, unmatched = assign_nodes(index, {
+        'pinned': {'mac': sparse.mac.upper()},
+        'any': {}})
+    assert unmatched == [] and names(assignment)['pinned'] == 12
+    assert index.capacities is None
+
+    # smallest fitting node is used, big one is kept for big requirements
+    index = CapacityIndex([small, big])
+    assignment, unmatched = assign_nodes(index, {
+        'compute': {'requirements': {'cpu_count_min': 1}},
+        'controller': {'requirements': {'mem_count_min': 32}}})
+    assert unmatched == []
+    assert names(assignment) == {'compute': 10, 'controller': 11}
+
+    assignment, unmatched = assign_nodes(index, {
+        'pinned': {'mac': big.mac},
+        'controller': {'requirements': {'mem_count_min': 32}}})
+    assert sorted(unmatched + names(assignment).keys()) == \
+        ['controller', 'pinned']
+    assert len(unmatched) == 1
+
+    # capacities are cached by node id between polls
+    cache = {}
+    CapacityIndex([small, big], cache).get_capacities()
+    small_again = FakeNode(10)
+    index = CapacityIndex([small_again], cache)
+    assert index.find({'cpu_count_min': 2}) == [small_again]
+
+
+if __name__ == "__main__":
+    test()
+    print "All tests pass OK"
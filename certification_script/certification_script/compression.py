@@ -0,0 +1,146 @@
+import zlib
+import threading
+
+
+ACCEPT_ENCODING = 'gzip, deflate'
+
+# wbits for zlib, 16 + MAX_WBITS - gzip container, MAX_WBITS - zlib
+# container, -MAX_WBITS - raw deflate stream, sent by some servers
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+ENCODING_WBITS = {'gzip': GZIP_WBITS,
+                  'x-gzip': GZIP_WBITS,
+                  'deflate': zlib.MAX_WBITS}
+
+
+class TransferStats(object):
+    """Bytes sent and received, as on the wire and after decoding"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.sent_raw = 0
+        self.received = 0
+        self.received_raw = 0
+
+    def add_sent(self, wire, raw):
+        with self.lock:
+            self.sent += wire
+            self.sent_raw += raw
+
+    def add_received(self, wire, raw):
+        with self.lock:
+            self.received += wire
+            self.received_raw += raw
+
+    def to_dict(self):
+        with self.lock:
+            return {'sent': self.sent,
+                    'sent_raw': self.sent_raw,
+                    'received': self.received,
+                    'received_raw': self.received_raw}
+
+    def __str__(self):
+        stats = self.to_dict()
+        return ("sent {sent} bytes ({sent_raw} raw), "
+                "received {received} bytes ({received_raw} raw)"
+                .format(**stats))
+
+
+class DecodingResponse(object):
+    """Decompresses response body while it's read
+
+    Same interface as PooledResponse, only one compressed chunk
+    is kept in memory
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, response, encoding, stats=None):
+        self.response = response
+        self.code = response.code
+        self.msg = response.msg
+        self.headers = response.headers
+        self.encoding = encoding
+        self.stats = stats
+        self.decompressor = zlib.decompressobj(ENCODING_WBITS[encoding])
+        self.first_chunk = True
+        self.buf = ''
+        self.eof = False
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def decompress(self, data):
+        try:
+            return self.decompressor.decompress(data)
+        except zlib.error:
+            # "deflate" is often sent without zlib header
+            if not (self.first_chunk and self.encoding == 'deflate'):
+                raise
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self.decompressor.decompress(data)
+        finally:
+            self.first_chunk = False
+
+    def fill(self, size):
+        """Read until buf has size bytes or body ends"""
+        while not self.eof and (size is None or len(self.buf) < size):
+            data = self.response.read(self.chunk_size)
+            if data == '':
+                self.eof = True
+                decoded = self.decompressor.flush()
+            else:
+                decoded = self.decompress(data)
+
+            if self.stats is not None:
+                self.stats.add_received(len(data), len(decoded))
+            self.buf += decoded
+
+    def read(self, amt=None):
+        self.fill(amt)
+        if amt is None:
+            data, self.buf = self.buf, ''
+        else:
+            data, self.buf = self.buf[:amt], self.buf[amt:]
+        return data
+
+    def close(self):
+        self.response.close()
+
+
+class CountingResponse(object):
+    """Accounts bytes of not compressed response body"""
+
+    def __init__(self, response, stats):
+        self.response = response
+        self.code = response.code
+        self.msg = response.msg
+        self.headers = response.headers
+        self.stats = stats
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def read(self, amt=None):
+        data = self.response.read(amt)
+        self.stats.add_received(len(data), len(data))
+        return data
+
+    def close(self):
+        self.response.close()
+
+
+def decode_response(response, stats=None):
+    """Wrap response to decompress body, according to Content-Encoding"""
+    encoding = (response.getheader('content-encoding') or '').strip().lower()
+    if encoding in ENCODING_WBITS:
+        return DecodingResponse(response, encoding, stats)
+    if stats is not None:
+        return CountingResponse(response, stats)
+    return response
+
+
+def gzip_body(data, level=6):
+    """Gzip data, result depends only on data, so recordings match"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
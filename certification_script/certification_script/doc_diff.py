@@ -0,0 +1,190 @@
+import copy
+
+
+def is_id_list(val):
+    return isinstance(val, list) and \
+        all(isinstance(item, dict) and 'id' in item for item in val)
+
+
+def diff(old, new, path=()):
+    """Returns list of (path, new value) for all changed values
+
+    Dicts are compared per key, lists of dicts with 'id' are compared
+    per id (path contains id instead of index), other values are
+    compared as a whole. Keys, absent in new, are ignored, as updates
+    never remove keys from server documents
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        res = []
+        for key, val in new.items():
+            if key not in old:
+                res.append((path + (key,), val))
+            else:
+                res.extend(diff(old[key], val, path + (key,)))
+        return res
+
+    if is_id_list(old) and is_id_list(new):
+        old_by_id = dict((item['id'], item) for item in old)
+        if set(old_by_id) == set(item['id'] for item in new):
+            res = []
+            for item in new:
+                res.extend(diff(old_by_id[item['id']], item,
+                                path + (item['id'],)))
+            return res
+
+    if old == new:
+        return []
+    return [(path, new)]
+
+
+def network_config_update(old, new):
+    """Minimal network configuration update, None if nothing changed
+
+    Only changed networks are sent, with id and changed fields, and only
+    changed networking parameters, as nailgun updates networks by id.
+    networks list is always present, nailgun validator requires it
+    """
+    changes = diff(old, new)
+    if not changes:
+        return None
+
+    res = {}
+    networks = {}
+    for path, _ in changes:
+        if path[0] == 'networks' and len(path) >= 3:
+            net = dict((net['id'], net) for net in new['networks'])[path[1]]
+            update = networks.setdefault(path[1], {'id': path[1]})
+            update[path[2]] = net[path[2]]
+        elif path[0] == 'networking_parameters' and len(path) >= 2:
+            res.setdefault(path[0], {})[path[1]] = new[path[0]][path[1]]
+        else:
+            res[path[0]] = new[path[0]]
+
+    if 'networks' not in res:
+        res['networks'] = [update for _, update in sorted(networks.items())]
+
+    return res
+
+
+def full_document_update(old, new):
+    """Whole document, if it changed, for resources, which PUT replaces"""
+    return new if diff(old, new) else None
+
+
+class DocumentEditor(object):
+    """Collects edits of server document and writes them at once
+
+    :param get: callable, returns current server document
+    :param put: callable, takes update document
+    :param make_update: callable(old, new), returns update document
+                        or None if there is nothing to write
+    """
+
+    def __init__(self, get, put, make_update=full_document_update):
+        self.get = get
+        self.put = put
+        self.make_update = make_update
+        self.original = None
+        self.document = None
+        self.writes = 0
+
+    def get_document(self):
+        """Document with pending edits, fetched on first use"""
+        if self.document is None:
+            self.original = self.get()
+            self.document = copy.deepcopy(self.original)
+        return self.document
+
+    def edit(self, func):
+        """Apply func to document, document is fetched on first edit"""
+        func(self.get_document())
+
+    def flush(self):
+        """Write pending edits, returns False if there was nothing to do"""
+        if self.document is None:
+            return False
+
+        update = self.make_update(self.original, self.document)
+        if update is None:
+            return False
+
+        self.put(update)
+        self.writes += 1
+        self.original = copy.deepcopy(self.document)
+        return True
+
+
+def test():
+    assert diff({'a': 1, 'b': {'c': 2}}, {'a': 1, 'b': {'c': 2}}) == []
+    assert diff({'a': 1}, {'a': 2}) == [(('a',), 2)]
+    assert diff({'a': {'b': 1}}, {'a': {'b': 1, 'c': 3}}) == \
+        [(('a', 'c'), 3)]
+    # removed keys are not updates
+    assert diff({'a': 1, 'b': 2}, {'a': 1}) == []
+    assert diff([1, 2], [2, 1]) == [((), [2, 1])]
+
+    # lists of objects with id are compared by id, not by position
+    old = [{'id': 1, 'x': 1}, {'id': 2, 'x': 2}]
+    assert diff(old, list(reversed(old))) == []
+    assert diff(old, [{'id': 2, 'x': 3}, {'id': 1, 'x': 1}]) == \
+        [((2, 'x'), 3)]
+    # different sets of ids replace whole list
+    new = [{'id': 1, 'x': 1}]
+    assert diff(old, new) == [((), new)]
+
+    nets = {'networks': [{'id': 1, 'name': 'public', 'vlan': None},
+                         {'id': 2, 'name': 'management', 'vlan': 101}],
+            'networking_parameters': {'floating_ranges': [], 'gre': 1},
+            'public_vip': '10.0.0.2'}
+    assert network_config_update(nets, copy.deepcopy(nets)) is None
+
+    new_nets = copy.deepcopy(nets)
+    new_nets['networking_parameters']['gre'] = 2
+    assert network_config_update(nets, new_nets) == \
+        {'networks': [], 'networking_parameters': {'gre': 2}}
+
+    new_nets = copy.deepcopy(nets)
+    new_nets['networks'][1]['vlan'] = 102
+    new_nets['networking_parameters']['gre'] = 2
+    assert network_config_update(nets, new_nets) == \
+        {'networks': [{'id': 2, 'vlan': 102}],
+         'networking_parameters': {'gre': 2}}
+
+    new_nets['public_vip'] = '10.0.0.3'
+    assert network_config_update(nets, new_nets)['public_vip'] == '10.0.0.3'
+
+    assert full_document_update({'a': 1}, {'a': 1}) is None
+    assert full_document_update({'a': 1}, {'a': 2}) == {'a': 2}
+
+    docs = [{'a': {'b': 1}}]
+    puts = []
+    editor = DocumentEditor(lambda: docs[0], puts.append)
+    assert not editor.flush()
+
+    # document is fetched once and shared with edits
+    fetches = []
+    counting = DocumentEditor(lambda: fetches.append(1) or {'a': 1},
+                              puts.append)
+    counting.get_document()
+    counting.edit(lambda doc: doc.update(a=2))
+    assert counting.get_document() == {'a': 2} and len(fetches) == 1
+    assert counting.flush() and puts.pop() == {'a': 2}
+
+    # nothing changed - no PUT
+    editor.edit(lambda doc: doc['a'].update(b=1))
+    assert not editor.flush() and puts == []
+
+    # edits are collected and written once, server copy is not touched
+    editor.edit(lambda doc: doc['a'].update(b=2))
+    editor.edit(lambda doc: doc.update(c=3))
+    assert docs[0] == {'a': {'b': 1}}
+    assert editor.flush() and puts == [{'a': {'b': 2}, 'c': 3}]
+    assert editor.writes == 1
+
+    # flushed state becomes new original
+    assert not editor.flush() and len(puts) == 1
+
+
+if __name__ == "__main__":
+    test()
+    print "All tests pass OK"
@@ -1,18 +1,26 @@
 import re
+import os
 import json
 import time
 import urllib2
-import pprint
+import hashlib
+import calendar
+import threading
+import collections
+from StringIO import StringIO
 from functools import partial, wraps
-import netaddr
-
 
+import polling
+import metrics
+import compression
+import doc_diff
 import type_check
-from certification_script.cert_script import *
-
+import token_manager
+from http_pool import ConnectionPool
+from json_stream import iter_json_array
 
-from keystoneclient.v2_0 import Client as keystoneclient
-from keystoneclient import exceptions
+# keystoneclient, netaddr and multiprocessing are imported where
+# they are used, they are slow to import and not needed on most runs
 
 
 logger = None
@@ -30,8 +38,19 @@ class Urllib2HTTP(object):
 
     allowed_methods = ('get', 'put', 'post', 'delete', 'patch', 'head')
 
-    def __init__(self, root_url, headers=None, echo=False):
+    def __init__(self, root_url, headers=None, echo=False, pool=None,
+                 concurrency=8, cache=None, request_metrics=None,
+                 compress_requests=None):
         """
+        :param pool: ConnectionPool to keep connections alive between
+                     requests, new one with default settings if None
+        :param concurrency: max count of requests, executed in background
+                            by do_async
+        :param cache: ResponseCache for GET requests, no caching if None
+        :param request_metrics: RequestMetrics to account requests,
+                                if not None
+        :param compress_requests: gzip request bodies of this size
+                                  and bigger, never if None
         """
         if root_url.endswith('/'):
             self.root_url = root_url[:-1]
@@ -40,8 +59,38 @@ class Urllib2HTTP(object):
 
         self.headers = headers if headers is not None else {}
         self.echo = echo
+        self.pool = pool if pool is not None else ConnectionPool()
+        self.concurrency = concurrency
+        self.workers = None
+        self.workers_lock = threading.Lock()
+        self.cache = cache
+        self.request_metrics = request_metrics
+        self.compress_requests = compress_requests
+        # None - unknown yet, see check_compression
+        self.compression_supported = None
+        self.transfer = compression.TransferStats()
 
     def do(self, method, path, params=None):
+        if self.cache is None:
+            return self.do_request(method, path, params)
+
+        if method == 'get':
+            found, result = self.cache.get(method, path)
+            if not found:
+                result = self.do_request(method, path, params)
+                self.cache.put(method, path, result)
+            return result
+
+        try:
+            return self.do_request(method, path, params)
+        finally:
+            self.cache.invalidate(path)
+
+    def send(self, method, path, params=None):
+        """Send request, returns response with body not read yet
+
+        Raises urllib2.HTTPError for error status codes
+        """
         if path.startswith('/'):
             url = self.root_url + path
         else:
@@ -56,28 +105,128 @@ class Urllib2HTTP(object):
         if self.echo:
             logger.info("HTTP: {} {}".format(method.upper(), url))
 
-        request = urllib2.Request(url,
-                                  data=data_json,
-                                  headers=self.headers)
+        headers = dict(self.headers)
+        headers.setdefault('Accept-Encoding', compression.ACCEPT_ENCODING)
         if data_json is not None:
-            request.add_header('Content-Type', 'application/json')
+            headers['Content-Type'] = 'application/json'
 
-        request.get_method = lambda: method.upper()
-        response = urllib2.urlopen(request)
+        stime = time.time()
+        body = self.encode_body(data_json, headers)
+        response = self.pool_request(method, url, path, body, headers)
+
+        if body is not data_json:
+            response = self.check_compression(method, url, path, data_json,
+                                              headers, response)
 
         if self.echo:
-            logger.info("HTTP REsponce: {}".format(response.code))
+            logger.info("HTTP REsponce: {} in {:.3f}s".format(
+                response.code, time.time() - stime))
+
+        if response.code >= 400:
+            content = response.read()
+            raise urllib2.HTTPError(url, response.code, response.msg,
+                                    response.headers, StringIO(content))
 
         if response.code < 200 or response.code > 209:
+            response.close()
             raise IndexError(url)
 
-        content = response.read()
+        return response
+
+    def check_compression(self, method, url, path, data_json, headers,
+                          response):
+        """Detect, if server accepts gzipped bodies, returns response
+
+        Nailgun answers 400 to compressed body, as it can't decode JSON,
+        so until first compressed request succeeds, failed request is
+        resent plain. Compression is disabled, if plain one succeeds,
+        else it was real error and support is still unknown
+        """
+        if self.compression_supported or response.code not in (400, 415):
+            if response.code < 400:
+                self.compression_supported = True
+            return response
+
+        response.close()
+        del headers['Content-Encoding']
+        # raw size is already accounted by encode_body
+        self.transfer.add_sent(len(data_json), 0)
+        response = self.pool_request(method, url, path, data_json, headers)
+
+        if response.code not in (400, 415):
+            logger.warning("Server rejected gzipped request body, "
+                           "disable request compression")
+            self.compress_requests = None
+        return response
+
+    def encode_body(self, data, headers):
+        """Gzip big request body, if enabled, updating headers"""
+        if data is None or self.compress_requests is None or \
+                len(data) < self.compress_requests:
+            if data is not None:
+                self.transfer.add_sent(len(data), len(data))
+            return data
+
+        body = compression.gzip_body(data)
+        headers['Content-Encoding'] = 'gzip'
+        self.transfer.add_sent(len(body), len(data))
+        return body
+
+    def pool_request(self, method, url, path, body, headers):
+        """Single request through pool, response body is decoded on read"""
+        stime = time.time()
+        try:
+            response = self.pool.request(method.upper(), url, body, headers)
+        except Exception:
+            if self.request_metrics is not None:
+                self.record(method, path, body, None, 0,
+                            time.time() - stime)
+            raise
+
+        if self.request_metrics is not None:
+            # latency and size are known when whole body is received
+            def on_done(bytes_in):
+                self.record(method, path, body, response.code, bytes_in,
+                            time.time() - stime)
+            response = metrics.MeteredResponse(response, on_done)
+
+        return compression.decode_response(response, self.transfer)
+
+    def record(self, method, path, body, code, bytes_in, latency):
+        bytes_out = len(body) if body is not None else 0
+        self.request_metrics.record(method, route_template(method, path), code,
+                            bytes_out, bytes_in, latency)
+
+    def do_request(self, method, path, params=None):
+        content = self.send(method, path, params).read()
 
         if '' == content:
             return None
 
         return json.loads(content)
 
+    def iter_get(self, path):
+        """GET JSON array, yielding elements as they are decoded"""
+        response = self.send('get', path)
+        try:
+            for element in iter_json_array(response):
+                yield element
+        finally:
+            response.close()
+
+    def do_async(self, method, path, params=None):
+        """Execute request in background thread
+
+        Returns AsyncResult, use gather to wait for results
+        """
+        with self.workers_lock:
+            if self.workers is None:
+                from multiprocessing.pool import ThreadPool
+                self.workers = ThreadPool(self.concurrency)
+        return self.workers.apply_async(
+            metrics.run_in_phase,
+            (metrics.current_phase(), self.do, method, path, params))
+
     def __getattr__(self, name):
         if name in self.allowed_methods:
             return partial(self.do, name)
@@ -86,38 +235,85 @@ class Urllib2HTTP(object):
 
 class KeystoneAuth(Urllib2HTTP):
     def __init__(self, root_url, creds, headers=None, echo=False,
-                 admin_node_ip=None):
-        super(KeystoneAuth, self).__init__(root_url, headers, echo)
+                 admin_node_ip=None, pool=None, concurrency=8,
+                 cache=None, request_metrics=None,
+                 compress_requests=None,
+                 token_cache_dir=token_manager.DEFAULT_CACHE_DIR):
+        """
+        :param token_cache_dir: directory to keep token between runs,
+                                don't keep if None
+        """
+        super(KeystoneAuth, self).__init__(root_url, headers, echo, pool,
+                                           concurrency, cache,
+                                           request_metrics,
+                                           compress_requests)
         self.keystone_url = "http://{0}:5000/v2.0".format(admin_node_ip)
-        self.keystone = keystoneclient(
-            auth_url=self.keystone_url, **creds)
-        self.refresh_token()
+        self.creds = creds
+        self.keystone = None
+
+        cache_file = None
+        if token_cache_dir is not None:
+            key = "{}:{}:{}".format(self.keystone_url,
+                                    creds.get('username'),
+                                    creds.get('tenant_name'))
+            cache_file = os.path.join(os.path.expanduser(token_cache_dir),
+                                      hashlib.md5(key).hexdigest() + '.json')
+
+        self.tokens = token_manager.TokenManager(self.authenticate,
+                                                 cache_file)
+
+    def authenticate(self):
+        """Get new token from keystone, returns (token, expiration time)"""
+        from keystoneclient.v2_0 import Client as keystoneclient
+        from keystoneclient import exceptions
+
+        if self.keystone is None:
+            self.keystone = keystoneclient(auth_url=self.keystone_url,
+                                           **self.creds)
 
-    def refresh_token(self):
-        """Get new token from keystone and update headers"""
         try:
             self.keystone.authenticate()
-            self.headers['X-Auth-Token'] = self.keystone.auth_token
         except exceptions.AuthorizationFailure:
             logger.warning(
                 'Cant establish connection to keystone with url %s',
                 self.keystone_url)
+            return None, None
 
-    def do(self, method, path, params=None):
-        """Do request. If gets 401 refresh token"""
+        expires = getattr(self.keystone.auth_ref, 'expires', None)
+        if expires is not None:
+            expires = calendar.timegm(expires.utctimetuple())
+
+        return self.keystone.auth_token, expires
+
+    def refresh_token(self, old_token=None):
+        """Update headers with valid token, old_token was rejected"""
+        if old_token is None:
+            token = self.tokens.get_token()
+        else:
+            token = self.tokens.invalidate(old_token)
+
+        if token is not None:
+            self.headers['X-Auth-Token'] = token
+
+    def send(self, method, path, params=None):
+        """Send request. If gets 401 refresh token"""
+        self.refresh_token()
+        token = self.headers.get('X-Auth-Token')
         try:
-            return super(KeystoneAuth, self).do(method, path, params)
+            return super(KeystoneAuth, self).send(method, path, params)
         except urllib2.HTTPError as e:
             if e.code == 401:
                 logger.warning('Authorization failure: {0}'.format(e.read()))
-                self.refresh_token()
-                return super(KeystoneAuth, self).do(method, path, params)
+                self.refresh_token(token)
+                return super(KeystoneAuth, self).send(method, path, params)
             else:
                 raise
 
 
+format_param_rr = re.compile(r"\{([a-zA-Z_]+)\}")
+
+
 def get_inline_param_list(url):
-    format_param_rr = re.compile(r"\{([a-zA-Z_]+)\}")
     for match in format_param_rr.finditer(url):
         yield match.group(1)
 
@@ -130,9 +326,13 @@ class RestObj(object):
         self.__dict__.update(kwargs)
         self.__connection__ = conn
 
+    def fields(self):
+        """Returns dict of object fields"""
+        return getattr(self, '__dict__', {})
+
     def __str__(self):
         res = ["{}({}):".format(self.__class__.__name__, self.name)]
-        for k, v in sorted(self.__dict__.items()):
+        for k, v in sorted(self.fields().items()):
             if k.startswith('__') or k.endswith('__'):
                 continue
             if k != 'name':
@@ -143,48 +343,138 @@ class RestObj(object):
         return getattr(self, item)
 
 
-def make_call(method, url):
-    def closure(obj, entire_obj=None, **data):
-        inline_params_vals = {}
-        for name in get_inline_param_list(url):
-            if name in data:
-                inline_params_vals[name] = data[name]
-                del data[name]
-            else:
-                inline_params_vals[name] = getattr(obj, name)
-        result_url = url.format(**inline_params_vals)
+class Route(object):
+    """REST call, compiled from method and url template"""
+
+    def __init__(self, method, url):
+        self.method = method
+        self.url = url
+        self.params = tuple(get_inline_param_list(url))
+        self.url_rr = metrics.make_route_rr(url)
+
+    def __repr__(self):
+        return "Route({!r}, {!r})".format(self.method, self.url)
+
+    def prepare(self, obj, entire_obj, data):
+        """Returns (url, data) for call on obj"""
+        if self.params:
+            inline_params_vals = {}
+            for name in self.params:
+                if name in data:
+                    inline_params_vals[name] = data.pop(name)
+                else:
+                    inline_params_vals[name] = getattr(obj, name)
+            result_url = self.url.format(**inline_params_vals)
+        else:
+            result_url = self.url
 
         if entire_obj is not None:
-            if data != {}:
+            if data:
                 raise ValueError("Both entire_obj and data provided")
             data = entire_obj
 
-        print result_url, data
+        return result_url, data
+
 
+# all routes, used by client
+route_table = []
+
+
+def make_call(method, url):
+    route = Route(method, url)
+    route_table.append(route)
+    prepare = route.prepare
+
+    def closure(obj, entire_obj=None, **data):
+        result_url, data = prepare(obj, entire_obj, data)
         return obj.__connection__.do(method, result_url, params=data)
+    closure.route = route
+    return closure
+
+
+def make_async_call(method, url):
+    route = Route(method, url)
+    route_table.append(route)
+    prepare = route.prepare
+
+    def closure(obj, entire_obj=None, **data):
+        result_url, data = prepare(obj, entire_obj, data)
+        return obj.__connection__.do_async(method, result_url, params=data)
+    closure.route = route
     return closure
 
 
+def route_template(method, path):
+    """Url template of known route, matching path, for metrics"""
+    path = path.lstrip('/')
+    for route in route_table:
+        if route.method == method and route.url_rr.match(path):
+            return route.url.lstrip('/')
+    return metrics.generic_route(path)
+
+
+def list_routes():
+    """Returns sorted list of (name, method, url) for all calls,
+    defined in this module
+    """
+    res = []
+    for name, val in globals().items():
+        if hasattr(val, 'route'):
+            res.append((name, val.route.method, val.route.url))
+        elif isinstance(val, type) and issubclass(val, RestObj):
+            for attr, func in vars(val).items():
+                if hasattr(func, 'route'):
+                    res.append(("{}.{}".format(name, attr),
+                                func.route.method, func.route.url))
+    return sorted(res)
+
+
 PUT = partial(make_call, 'put')
 GET = partial(make_call, 'get')
 DELETE = partial(make_call, 'delete')
 
+AGET = partial(make_async_call, 'get')
+APUT = partial(make_async_call, 'put')
+ADELETE = partial(make_async_call, 'delete')
+
+
+def gather(async_results, timeout=None):
+    """Wait for all results of async calls, returns list of values
+
+    Reraises first error, if any request failed
+    """
+    ctime = time.time()
+    res = []
+    for async_res in async_results:
+        if timeout is None:
+            # AsyncResult.get without timeout ignores KeyboardInterrupt
+            res.append(async_res.get(1E9))
+        else:
+            res.append(async_res.get(max(0, ctime + timeout - time.time())))
+    return res
+
+
+class BulkOperationError(Exception):
+    """Operation failed for some objects
+
+    errors maps object id to exception
+    """
+    def __init__(self, message, errors):
+        descr = ", ".join("{}: {}".format(obj_id, exc)
+                          for obj_id, exc in sorted(errors.items()))
+        super(BulkOperationError, self).__init__(
+            "{} ({})".format(message, descr))
+        self.errors = errors
 
-def with_timeout(tout, message):
+
+def with_timeout(tout, message, policy=None):
+    """Decorator: wait until function returns True, polling it
+    according to policy (name from polling.POLICIES or PollPolicy)
+    """
     def closure(func):
         @wraps(func)
         def closure2(*dt, **mp):
-            ctime = time.time()
-            etime = ctime + tout
-
-            while ctime < etime:
-                if func(*dt, **mp):
-                    return
-                sleep_time = ctime + 1 - time.time()
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
-                ctime = time.time()
-            raise RuntimeError("Timeout during " + message)
+            polling.wait(lambda: func(*dt, **mp), tout, message, policy)
         return closure2
     return closure
 
@@ -223,6 +513,22 @@ class FuelInfo(RestObj):
         return [Cluster(self.__connection__, **cluster) for cluster
                 in self.get_clusters()]
 
+    def iter_nodes(self):
+        """Yield all fuel nodes, decoding response incrementally"""
+        return get_all_nodes(self.__connection__, stream=True)
+
+    def select_nodes(self, fields=None, compact=False):
+        """Get all fuel nodes, keeping only fields listed
+
+        :param compact: make CompactNode instead of Node
+        """
+        return NodeList(get_all_nodes(self.__connection__, stream=True,
+                                      fields=fields, compact=compact))
+
+    def get_nodes_info(self, nodes):
+        """Get full info for each node concurrently"""
+        return gather([node.get_info_async() for node in nodes])
+
 
 def remap_saved_networks(mapping):
     # only for saved networks
@@ -237,13 +543,54 @@ def remap_saved_networks(mapping):
         interface['assigned_networks'] = new_assigment[interface['name']]
 
 
+def assign_networks(curr_interfaces, mapping, cluster_network_ids=None):
+    """Update interfaces description in place with new networks mapping
+
+    :param curr_interfaces: interfaces, as returned by Fuel
+    :param mapping: dict iface name -> list of network names
+    :param cluster_network_ids: dict network name -> id, networks,
+                                assigned to interfaces, are used if None
+    """
+    network_ids = {}
+    for interface in curr_interfaces:
+        for net in interface['assigned_networks']:
+            network_ids[net['name']] = net['id']
+
+    if cluster_network_ids is not None:
+        network_ids.update(cluster_network_ids)
+
+    #transform mappings
+    new_assigned_networks = {}
+
+    for dev_name, networks in mapping.items():
+        new_assigned_networks[dev_name] = []
+        for net_name in networks:
+            nnet = {'name': net_name, 'id': network_ids[net_name]}
+            new_assigned_networks[dev_name].append(nnet)
+
+    # update by ref
+    for dev_descr in curr_interfaces:
+        if dev_descr['name'] in new_assigned_networks:
+            nass = new_assigned_networks[dev_descr['name']]
+            dev_descr['assigned_networks'] = nass
+
+    return curr_interfaces
+
+
 class Node(RestObj):
     """Represents node in Fuel"""
 
-    get_info = GET('/api/nodes/{id}')
+    # consistent copy of node info, attached by Cluster.hydrate_nodes
+    __snapshot__ = None
+
+    fetch_info = GET('/api/nodes/{id}')
     get_interfaces = GET('/api/nodes/{id}/interfaces')
     update_interfaces = PUT('/api/nodes/{id}/interfaces')
 
+    get_info_async = AGET('/api/nodes/{id}')
+    get_interfaces_async = AGET('/api/nodes/{id}/interfaces')
+    update_interfaces_async = APUT('/api/nodes/{id}/interfaces')
+
     def set_network_assigment(self, mapping):
         """Assings networks to interfaces
         :param mapping: list (dict) interfaces info
@@ -252,33 +599,34 @@ class Node(RestObj):
         type_check.check({str: [str]}, mapping)
 
         curr_interfaces = self.get_interfaces()
-
-        network_ids = {}
-        for interface in curr_interfaces:
-            for net in interface['assigned_networks']:
-                network_ids[net['name']] = net['id']
-
-        #transform mappings
-        new_assigned_networks = {}
-
-        for dev_name, networks in mapping.items():
-            new_assigned_networks[dev_name] = []
-            for net_name in networks:
-                nnet = {'name': net_name, 'id': network_ids[net_name]}
-                new_assigned_networks[dev_name].append(nnet)
-
-        # update by ref
-        for dev_descr in curr_interfaces:
-            if dev_descr['name'] in new_assigned_networks:
-                nass = new_assigned_networks[dev_descr['name']]
-                dev_descr['assigned_networks'] = nass
-
+        assign_networks(curr_interfaces, mapping)
         self.update_interfaces(curr_interfaces, id=self.id)
 
     def set_node_name(self, name):
         """Update node name"""
         self.__connection__.put('nodes', [{'id': self.id, 'name': name}])
 
+    def attach_snapshot(self, node_info):
+        """Use node_info for all info accessors until refresh"""
+        self.__dict__.update(node_info)
+        self.__snapshot__ = node_info
+
+    def refresh(self):
+        """Fetch fresh node info and update snapshot"""
+        self.attach_snapshot(self.fetch_info())
+        return self.__snapshot__
+
+    def get_info(self, refresh=False):
+        """Returns node info
+
+        Answers from snapshot, if one is attached, else requests Fuel
+        """
+        if self.__snapshot__ is None:
+            return self.fetch_info()
+        if refresh:
+            return self.refresh()
+        return self.__snapshot__
+
     def get_network_data(self):
         """Returns node network data"""
         node_info = self.get_info()
@@ -297,36 +645,272 @@ class Node(RestObj):
 
         :param network: network to pick
         """
-        nets = self.get_network_data()
-        for net in nets:
+        node_info = self.get_info()
+        for net in node_info['network_data']:
             if net['name'] == network:
                 iface_name = net['dev']
-                for iface in self.get_info()['meta']['interfaces']:
+                for iface in node_info['meta']['interfaces']:
                     if iface['name'] == iface_name:
                         try:
                             return iface['ip']
                         except KeyError:
+                            import netaddr
                             return netaddr.IPNetwork(net['ip']).ip
         raise Exception('Network %s not found' % network)
 
 
+class CompactNode(Node):
+    """Node, which keeps most used fields in slots and hardware meta
+    as JSON string, decoded on each access
+
+    Other fields go to __dict__, which is not created if there are none
+    """
+
+    __slots__ = ('__connection__', 'id', 'name', 'mac', 'roles',
+                 'pending_roles', 'cluster', 'status', 'online', '_meta')
+
+    slot_fields = __slots__[1:-1]
+
+    def __init__(self, conn, **kwargs):
+        self.__connection__ = conn
+        for field in self.slot_fields:
+            setattr(self, field, kwargs.pop(field, None))
+
+        meta = kwargs.pop('meta', None)
+        if meta is not None:
+            meta = json.dumps(meta, separators=(',', ':'))
+        self._meta = meta
+
+        if kwargs:
+            self.__dict__.update(kwargs)
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            raise AttributeError('meta')
+        return json.loads(self._meta)
+
+    def attach_snapshot(self, node_info):
+        """Slots and meta property shadow __dict__, so update them"""
+        self.__snapshot__ = node_info
+        node_info = dict(node_info)
+        for field in self.slot_fields:
+            if field in node_info:
+                setattr(self, field, node_info.pop(field))
+
+        if 'meta' in node_info:
+            meta = node_info.pop('meta')
+            if meta is not None:
+                meta = json.dumps(meta, separators=(',', ':'))
+            self._meta = meta
+
+        self.__dict__.update(node_info)
+
+    def fields(self):
+        res = dict((field, getattr(self, field))
+                   for field in self.slot_fields)
+        if self._meta is not None:
+            res['meta'] = self.meta
+        res.update(super(CompactNode, self).fields())
+        return res
+
+
+def project(descr, fields):
+    """Keep only fields (and id) in object description"""
+    if fields is None:
+        return descr
+    return dict((field, descr[field]) for field in set(fields) | set(['id'])
+                if field in descr)
+
+
 class NodeList(list):
-    """Class for filtering nodes through attributes"""
+    """List of nodes with indexes for fast filtering
+
+    Nodes are indexed by indexed_fields on first query, indexes are
+    updated by append/extend and by reindex/refresh, other changes of
+    list drop indexes. Role name as attribute returns nodes with role.
+    """
     allowed_roles = ['controller', 'compute', 'cinder', 'ceph-osd', 'mongo',
                      'zabbix-server']
 
+    # fields with list values, node is indexed by each element
+    multi_value_fields = ('roles', 'pending_roles')
+    indexed_fields = multi_value_fields + ('status', 'cluster', 'mac',
+                                           'online')
+
+    def __init__(self, nodes=()):
+        super(NodeList, self).__init__(nodes)
+        self._indexes = None
+        self._node_keys = {}
+
     def __getattr__(self, name):
-        if name in self.allowed_roles:
-            return [node for node in self if name in node.roles]
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        if name in self.allowed_roles or \
+                name in self.get_indexes()['roles']:
+            return self.by('roles', name)
+
+        raise AttributeError("{!r} object has no attribute {!r}".format(
+            self.__class__.__name__, name))
+
+    @classmethod
+    def index_keys(cls, node):
+        """Returns list of (field, value) to index node by"""
+        keys = []
+        for field in cls.indexed_fields:
+            try:
+                val = getattr(node, field)
+            except AttributeError:
+                continue
+
+            if field in cls.multi_value_fields:
+                keys.extend((field, item) for item in (val or ()))
+            elif field == 'mac' and val is not None:
+                keys.append((field, val.upper()))
+            else:
+                keys.append((field, val))
+        return keys
+
+    def get_indexes(self):
+        if self._indexes is None:
+            self._indexes = dict((field, {}) for field in self.indexed_fields)
+            self._node_keys = {}
+            for node in self:
+                self._add_to_indexes(node)
+        return self._indexes
+
+    def _add_to_indexes(self, node):
+        keys = self.index_keys(node)
+        self._node_keys[id(node)] = keys
+        for field, val in keys:
+            bucket = self._indexes[field].get(val)
+            if bucket is None:
+                bucket = self._indexes[field][val] = \
+                    collections.OrderedDict()
+            bucket[id(node)] = node
+
+    def _remove_from_indexes(self, node):
+        for field, val in self._node_keys.pop(id(node), ()):
+            bucket = self._indexes[field][val]
+            del bucket[id(node)]
+            if not bucket:
+                del self._indexes[field][val]
+
+    def reindex(self, node):
+        """Update indexes after node fields were changed"""
+        if self._indexes is not None:
+            self._remove_from_indexes(node)
+            self._add_to_indexes(node)
+
+    def refresh(self, nodes=None):
+        """Fetch fresh info for nodes (all if None) and update indexes"""
+        nodes = list(self if nodes is None else nodes)
+        infos = gather([node.get_info_async() for node in nodes])
+        for node, info in zip(nodes, infos):
+            node.attach_snapshot(info)
+            self.reindex(node)
+
+    def by(self, field, val):
+        """Nodes, which have val in field (or val in list field)"""
+        if field == 'mac' and val is not None:
+            val = val.upper()
+        return NodeList(self.get_indexes()[field].get(val, {}).values())
+
+    def by_mac(self, mac):
+        """Returns node with mac or None"""
+        found = self.get_indexes()['mac'].get(mac.upper())
+        return next(iter(found.values())) if found else None
+
+    def query(self, where=None, **conditions):
+        """Nodes, matching all conditions, e.g.
+        query(roles='compute', online=True,
+              where=lambda node: node.meta['memory']['total'] > 64 * 1024 ** 3)
+
+        :param conditions: indexed field -> value, like in by()
+        :param where: additional predicate for nodes
+        """
+        indexes = self.get_indexes()
+        buckets = []
+        for field, val in conditions.items():
+            if field not in indexes:
+                raise ValueError("Field {!r} is not indexed".format(field))
+            if field == 'mac' and val is not None:
+                val = val.upper()
+            buckets.append(indexes[field].get(val, {}))
+
+        if not buckets:
+            found = list(self)
+        else:
+            buckets.sort(key=len)
+            found = [node for node_id, node in buckets[0].items()
+                     if all(node_id in bucket for bucket in buckets[1:])]
+
+        if where is not None:
+            found = [node for node in found if where(node)]
+
+        return NodeList(found)
+
+    def append(self, node):
+        super(NodeList, self).append(node)
+        if self._indexes is not None:
+            self._add_to_indexes(node)
+
+    def extend(self, nodes):
+        nodes = list(nodes)
+        super(NodeList, self).extend(nodes)
+        if self._indexes is not None:
+            for node in nodes:
+                self._add_to_indexes(node)
+
+    def __iadd__(self, nodes):
+        self.extend(nodes)
+        return self
+
+    # other changes of list just drop indexes, they are rare
+    def insert(self, pos, node):
+        self._indexes = None
+        super(NodeList, self).insert(pos, node)
+
+    def remove(self, node):
+        self._indexes = None
+        super(NodeList, self).remove(node)
+
+    def pop(self, *args):
+        self._indexes = None
+        return super(NodeList, self).pop(*args)
+
+    def __setitem__(self, pos, val):
+        self._indexes = None
+        super(NodeList, self).__setitem__(pos, val)
+
+    def __delitem__(self, pos):
+        self._indexes = None
+        super(NodeList, self).__delitem__(pos)
+
+    def __setslice__(self, start, stop, val):
+        self._indexes = None
+        super(NodeList, self).__setslice__(start, stop, val)
+
+    def __delslice__(self, start, stop):
+        self._indexes = None
+        super(NodeList, self).__delslice__(start, stop)
+
+    def get_ips(self, network='public'):
+        """Get ip in network for each node"""
+        return [node.get_ip(network) for node in self]
 
 
 class Cluster(RestObj):
     """Class represents Cluster in Fuel"""
 
     add_node_call = PUT('api/nodes')
+    update_nodes_interfaces = PUT('api/nodes/interfaces')
     start_deploy = PUT('api/clusters/{id}/changes')
     get_status = GET('api/clusters/{id}')
     delete = DELETE('api/clusters/{id}')
+    get_status_async = AGET('api/clusters/{id}')
+    delete_async = ADELETE('api/clusters/{id}')
     get_tasks_status = GET("api/tasks?tasks={id}")
     get_networks = GET('api/clusters/{id}/network_configuration/{net_provider}')
     configure_networks = PUT('api/clusters/{id}/network_configuration/{net_provider}')
@@ -337,6 +921,45 @@ class Cluster(RestObj):
         super(Cluster, self).__init__(*dt, **mp)
         self.nodes = NodeList()
         self.network_roles = {}
+        self.__watcher__ = None
+        self.__networks_editor__ = None
+        self.__attributes_editor__ = None
+
+    def get_networks_editor(self):
+        """DocumentEditor for network configuration, edits are written
+        by flush_networks with single minimal PUT
+        """
+        if self.__networks_editor__ is None:
+            self.__networks_editor__ = doc_diff.DocumentEditor(
+                lambda: self.get_networks(
+                    net_provider=self.get_net_provider()),
+                lambda update: self.configure_networks(
+                    update, net_provider=self.get_net_provider()),
+                doc_diff.network_config_update)
+        return self.__networks_editor__
+
+    def get_net_provider(self):
+        net_provider = getattr(self, 'net_provider', None)
+        if net_provider is None:
+            net_provider = self.net_provider = \
+                self.get_status()['net_provider']
+        return net_provider
+
+    def get_attributes_editor(self):
+        """DocumentEditor for cluster attributes, PUT replaces attributes,
+        so whole document is written, but only if it changed
+        """
+        if self.__attributes_editor__ is None:
+            self.__attributes_editor__ = doc_diff.DocumentEditor(
+                lambda: get_cluster_attributes(self),
+                lambda update: update_cluster_attributes(self, update))
+        return self.__attributes_editor__
+
+    def flush_networks(self):
+        """Write pending network configuration edits, if any"""
+        if not self.get_networks_editor().flush():
+            logger.debug("Network configuration of cluster {} unchanged"
+                         .format(self.name))
 
     def check_exists(self):
         """Check if cluster exists"""
@@ -352,6 +975,27 @@ class Cluster(RestObj):
         for node_descr in self._get_nodes():
             yield Node(self.__connection__, **node_descr)
 
+    def hydrate_nodes(self):
+        """Get all cluster nodes with one request
+
+        Each node gets consistent snapshot of its info, so accessors
+        like Node.get_ip don't make requests until Node.refresh
+        """
+        self.nodes = NodeList()
+        for node_descr in self._get_nodes():
+            node = Node(self.__connection__)
+            node.attach_snapshot(node_descr)
+            self.nodes.append(node)
+        return self.nodes
+
+    def get_nodes_ip(self, role, network='public'):
+        """Get ip in network of all nodes with role, with one request"""
+        return getattr(self.hydrate_nodes(), role).get_ips(network)
+
+    def get_nodes_info(self):
+        """Get full info for all cluster nodes concurrently"""
+        return gather([node.get_info_async() for node in self.get_nodes()])
+
     def add_node(self, node, roles, interfaces=None):
         """Add node to cluster
 
@@ -359,30 +1003,123 @@ class Cluster(RestObj):
         :param roles: roles to assign
         :param interfaces: mapping iface name to networks
         """
-        data = {}
-        data['pending_roles'] = roles
-        data['cluster_id'] = self.id
-        data['id'] = node.id
-        data['pending_addition'] = True
-        logger.debug("Adding node %s to cluster..." % node.id)
-        self.add_node_call([data])
-        self.nodes.append(node)
-
-        if interfaces is not None:
-            networks = {}
-            for iface_name, params in interfaces.items():
-                networks[iface_name] = params['networks']
-
-            node.set_network_assigment(networks)
+        self.add_nodes([(node, roles, interfaces)])
+
+    def add_nodes(self, nodes_descr):
+        """Add several nodes to cluster
+
+        All roles are assigned with one request, all interfaces are
+        updated with another one. Raises BulkOperationError with errors
+        for nodes, which interfaces can't be updated.
+
+        :param nodes_descr: list of (node, roles, interfaces), interfaces
+                            maps iface name to networks and can be None
+        """
+        data = []
+        for node, roles, _ in nodes_descr:
+            data.append({'pending_roles': roles,
+                         'cluster_id': self.id,
+                         'id': node.id,
+                         'pending_addition': True})
+
+        node_ids = [node.id for node, _, _ in nodes_descr]
+        logger.debug("Adding nodes %s to cluster..." % node_ids)
+        self.add_node_call(data)
+        self.nodes.extend(node for node, _, _ in nodes_descr)
+
+        mappings = []
+        for node, _, interfaces in nodes_descr:
+            if interfaces is not None:
+                networks = {}
+                for iface_name, params in interfaces.items():
+                    networks[iface_name] = params['networks']
+                mappings.append((node, networks))
+
+        if mappings:
+            self.set_network_assigments(mappings)
+
+    def get_network_ids(self):
+        """Returns dict network name -> id for cluster networks
+
+        Network configuration is shared with networks editor, so it's
+        requested once per deployment
+        """
+        configuration = self.get_networks_editor().get_document()
+        return dict((net['name'], net['id'])
+                    for net in configuration['networks'])
+
+    def set_network_assigments(self, mappings):
+        """Assings networks to interfaces of several nodes
+
+        Network ids are resolved once for cluster, interfaces of all
+        nodes are requested concurrently and updated with one request
+        to collection endpoint. If it fails, nodes are updated one
+        by one in background, so errors are known for each node.
+
+        :param mappings: list of (node, {iface name: [network names]})
+        """
+        errors = {}
+        requests = []
+        for node, mapping in mappings:
+            try:
+                type_check.check({str: [str]}, mapping)
+            except AssertionError as exc:
+                errors[node.id] = exc
+            else:
+                requests.append((node, mapping, node.get_interfaces_async()))
+
+        network_ids = self.get_network_ids() if requests else {}
+
+        updates = []
+        for node, mapping, async_res in requests:
+            try:
+                curr_interfaces = gather([async_res])[0]
+                assign_networks(curr_interfaces, mapping, network_ids)
+            except Exception as exc:
+                errors[node.id] = exc
+            else:
+                updates.append((node, curr_interfaces))
+
+        if updates:
+            try:
+                self.update_nodes_interfaces([
+                    {'id': node.id, 'interfaces': interfaces}
+                    for node, interfaces in updates])
+            except urllib2.HTTPError as exc:
+                logger.warning("Bulk interfaces update failed ({}), "
+                               "updating nodes one by one".format(exc))
+                errors.update(self.update_interfaces_per_node(updates))
+
+        if errors:
+            raise BulkOperationError("Failed to assign networks", errors)
+
+    @staticmethod
+    def update_interfaces_per_node(updates):
+        """Update interfaces with request per node, returns errors"""
+        errors = {}
+        requests = [(node, node.update_interfaces_async(interfaces,
+                                                        id=node.id))
+                    for node, interfaces in updates]
+        for node, async_res in requests:
+            try:
+                gather([async_res])
+            except Exception as exc:
+                errors[node.id] = exc
+        return errors
+
+    def get_watcher(self):
+        """Returns ClusterWatcher, shared by all users of this object"""
+        if self.__watcher__ is None:
+            self.__watcher__ = ClusterWatcher(self)
+        return self.__watcher__
 
     def wait_operational(self, timeout):
         """Wait until cluster status operational"""
-        def wo():
-            status = self.get_status()['status']
-            if status == "error":
+        def wo(status, _):
+            if status['status'] == "error":
                 raise Exception("Cluster deploy failed")
-            return self.get_status()['status'] == 'operational'
-        with_timeout(timeout, "deploy cluster")(wo)()
+            return status['status'] == 'operational'
+        self.get_watcher().wait(wo, timeout, "deploy cluster")
 
     def deploy(self, timeout):
         """Start deploy and wait until all tasks finished"""
@@ -391,44 +1128,188 @@ class Cluster(RestObj):
 
         self.wait_operational(timeout)
 
-        def all_tasks_finished_ok(obj):
+        def all_tasks_finished_ok(_, tasks):
             ok = True
-            for task in obj.get_tasks_status():
+            for task in tasks:
                 if task['status'] == 'error':
                     raise Exception('Task execution error')
                 elif task['status'] != 'ready':
                     ok = False
             return ok
 
-        wto = with_timeout(timeout, "wait deployment finished")
-        wto(all_tasks_finished_ok)(self)
+        self.get_watcher().wait(all_tasks_finished_ok, timeout,
+                                "wait deployment finished")
 
-    def set_networks(self, net_descriptions):
-        """Update cluster networking parameters"""
-        configuration = self.get_networks()
-        current_networks = configuration['networks']
-        parameters = configuration['networking_parameters']
+    # other fields (id, cluster_id, group_id) are owned by server and
+    # would point network of this cluster to objects of saved one
+    editable_network_fields = ('cidr', 'gateway', 'ip_ranges', 'vlan_start',
+                               'meta', 'notation')
 
-        if net_descriptions.get('networks'):
-            # net_mapping = {}
-            # for net_description in net_descriptions['networks']:
-            #     print net_description + "!!!!!!!!111one"
-            #     net_mapping[net_descriptions[net_description["name"]]] = net_descriptions
-            net_mapping = net_descriptions['networks']
+    def set_networks(self, net_descriptions, flush=True):
+        """Update cluster networking parameters
 
-            print "!!!!!!!!!!!!!!!!!!"
-            pprint.pprint(net_mapping)
-            print "-" * 80
+        :param flush: write changes now, else they are written
+                      together with next edits by flush_networks
+        """
+        def update(configuration):
+            if net_descriptions.get('networks'):
+                net_mapping = net_descriptions['networks']
+                # saved configs contain networks list, with ids
+                # of networks from other cluster
+                if isinstance(net_mapping, list):
+                    net_mapping = dict((net['name'], net)
+                                       for net in net_mapping)
+
+                for net in configuration['networks']:
+                    net_desc = net_mapping.get(net['name'])
+                    if net_desc:
+                        net.update((key, val)
+                                   for key, val in net_desc.items()
+                                   if key in self.editable_network_fields)
+
+            if net_descriptions.get('networking_parameters'):
+                configuration['networking_parameters'].update(
+                    net_descriptions['networking_parameters'])
+
+        self.get_networks_editor().edit(update)
+        if flush:
+            self.flush_networks()
+
+
+class StateFuture(object):
+    """Result of waiting for cluster state, see ClusterWatcher.future"""
+
+    def __init__(self, predicate):
+        self.predicate = predicate
+        self.event = threading.Event()
+        self.error = None
+
+    def __call__(self, status, tasks):
+        try:
+            if self.predicate(status, tasks):
+                self.event.set()
+        except Exception as exc:
+            self.error = exc
+            self.event.set()
+
+    def done(self):
+        return self.event.is_set()
+
+    def wait(self, timeout=None):
+        """Returns True if predicate became true, reraises its errors"""
+        self.event.wait(timeout)
+        if self.error is not None:
+            # pylint can't see that error is not None here
+            raise self.error  # pylint: disable=raising-bad-type
+        return self.event.is_set()
+
+
+class ClusterWatcher(object):
+    """Polls cluster status and tasks at most once per interval and
+    notifies subscribers about changes
+
+    Subscribers are called as callback(status, tasks) from thread,
+    which polled the cluster. Interval defaults to min_interval of
+    policy, so it follows polling.configure and polling.compress
+    """
 
-            for net in current_networks:
-                net_desc = net_mapping.get(net['name'])
-                if net_desc:
-                    net.update(net_desc)
+    def __init__(self, cluster, interval=None, policy='deploy'):
+        self.cluster = cluster
+        self.interval = interval
+        self.policy = policy
+
+        self.status = None
+        self.tasks = None
+        self.updated = None
+
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def get_interval(self):
+        if self.interval is not None:
+            return self.interval
+        return polling.get_policy(self.policy).min_interval
+
+    def subscribe(self, callback):
+        with self.lock:
+            self.subscribers.append(callback)
+            status, tasks = self.status, self.tasks
+        if status is not None:
+            callback(status, tasks)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def future(self, predicate):
+        """Returns StateFuture, which completes when
+        predicate(status, tasks) returns True or raises
+        """
+        fut = StateFuture(predicate)
+        self.subscribe(fut)
+        return fut
 
-        if net_descriptions.get('networking_parameters'):
-            parameters.update(net_descriptions['networking_parameters'])
+    def refresh(self, max_age=None):
+        """Poll cluster unless state is fresher than max_age seconds
 
-        self.configure_networks(**configuration)
+        Concurrent callers share one request
+        """
+        if max_age is None:
+            max_age = self.get_interval()
+
+        with self.lock:
+            if self.updated is not None and \
+                    time.time() - self.updated < max_age:
+                return self.status, self.tasks
+
+            status = self.cluster.get_status()
+            tasks = self.cluster.get_tasks_status()
+            self.updated = time.time()
+
+            changed = (status, tasks) != (self.status, self.tasks)
+            self.status, self.tasks = status, tasks
+            subscribers = self.subscribers[:]
+
+        if changed:
+            for callback in subscribers:
+                callback(status, tasks)
+            for fut in subscribers:
+                if isinstance(fut, StateFuture) and fut.done():
+                    self.unsubscribe(fut)
+
+        return status, tasks
+
+    def wait(self, predicate, timeout, message):
+        """Wait until predicate(status, tasks) returns True"""
+        def check():
+            return predicate(*self.refresh())
+        with_timeout(timeout, message, self.policy)(check)()
+
+    def start(self):
+        """Poll cluster in background thread until stop"""
+        def poll_loop():
+            intervals = polling.get_policy(self.policy).intervals()
+            while not self.stopped.is_set():
+                try:
+                    self.refresh()
+                except Exception as exc:
+                    logger.warning("Failed to get cluster {} state: {}"
+                                   .format(self.cluster.id, exc))
+                self.stopped.wait(max(self.get_interval(), next(intervals)))
+
+        self.stopped.clear()
+        self.thread = threading.Thread(target=poll_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
 
 
 def reflect_cluster(conn, cluster_id):
@@ -438,18 +1319,43 @@ def reflect_cluster(conn, cluster_id):
     return c
 
 
-def get_all_nodes(conn):
-    """Get all nodes from Fuel"""
-    for node_desc in conn.get('api/nodes'):
-        yield Node(conn, **node_desc)
+def get_all_nodes(conn, stream=False, fields=None, compact=False):
+    """Get all nodes from Fuel
+
+    :param stream: decode response incrementally, so only one node
+                   description is in memory at a time
+    :param fields: keep only these fields (and id), all if None
+    :param compact: make CompactNode instead of Node
+    """
+    if stream:
+        nodes = conn.iter_get('api/nodes')
+    else:
+        nodes = conn.get('api/nodes')
 
+    node_cls = CompactNode if compact else Node
+    for node_desc in nodes:
+        yield node_cls(conn, **project(node_desc, fields))
 
-def get_all_clusters(conn):
-    """Get all clusters"""
-    for cluster_desc in conn.get('api/clusters'):
+
+def get_all_clusters(conn, stream=False):
+    """Get all clusters
+
+    :param stream: decode response incrementally
+    """
+    if stream:
+        clusters = conn.iter_get('api/clusters')
+    else:
+        clusters = conn.get('api/clusters')
+
+    for cluster_desc in clusters:
         yield Cluster(conn, **cluster_desc)
 
 
+def get_clusters_status(clusters):
+    """Get status for several clusters concurrently"""
+    return gather([cluster.get_status_async() for cluster in clusters])
+
+
 get_cluster_attributes = GET('api/clusters/{id}/attributes')
 
 
@@ -503,15 +1409,84 @@ def create_empty_cluster(conn, cluster_desc, debug_mode=False):
     cluster = Cluster(conn, **params)
 
     settings = cluster_desc['settings']
-    attributes = get_cluster_attributes(cluster)
 
-    ed_attrs = attributes['editable']
-    for option, value in settings.items():
-        if option in sections:
-            attr_val_dict = ed_attrs[sections[option]][option]
-            attr_val_dict['value'] = value
+    def update(attributes):
+        ed_attrs = attributes['editable']
+        for option, value in settings.items():
+            if option in sections:
+                attr_val_dict = ed_attrs[sections[option]][option]
+                attr_val_dict['value'] = value
 
-    ed_attrs['common']['debug']['value'] = debug_mode
-    update_cluster_attributes(cluster, attributes)
+        ed_attrs['common']['debug']['value'] = debug_mode
+
+    attributes_editor = cluster.get_attributes_editor()
+    attributes_editor.edit(update)
+    attributes_editor.flush()
 
     return cluster
+
+
+def test():
+    from recording import ReplayResponse
+
+    infos = {}
+
+    class InfoPool(object):
+        def request(self, method, url, body=None, headers=None):
+            node_id = int(url.rsplit('/', 1)[1])
+            return ReplayResponse(200, 'OK', {}, json.dumps(infos[node_id]))
+
+    conn = Urllib2HTTP('http://fuel', pool=InfoPool())
+    ids = lambda nodes: sorted(node.id for node in nodes)
+
+    for node_cls in (Node, CompactNode):
+        infos[1] = dict(id=1, roles=['compute'], pending_roles=[],
+                        status='discover', cluster=None, online=True,
+                        mac='aa:bb', meta={'memory': {'total': 1}})
+        infos[2] = dict(infos[1], id=2, mac='cc:dd')
+        nodes = NodeList(node_cls(conn, **info) for info in infos.values())
+
+        assert ids(nodes.by('status', 'discover')) == [1, 2]
+        assert ids(nodes.compute) == [1, 2]
+
+        infos[1] = dict(infos[1], roles=['controller'], status='ready',
+                        meta={'memory': {'total': 2}})
+        nodes.refresh()
+
+        assert ids(nodes.by('status', 'ready')) == [1]
+        assert ids(nodes.by('status', 'discover')) == [2]
+        assert ids(nodes.controller) == [1]
+        assert ids(nodes.compute) == [2]
+        assert ids(nodes.query(roles='controller', status='ready')) == [1]
+        assert ids(nodes.query(roles='compute', status='ready')) == []
+        assert ids(nodes.query(
+            where=lambda node: node.meta['memory']['total'] > 1)) == [1]
+        assert nodes.by_mac('AA:BB').status == 'ready'
+
+    conn.workers.close()
+
+    # replay compresses poll intervals, watcher should follow them
+    saved_policies = dict(polling.POLICIES)
+    polling.compress(0)
+    try:
+        statuses = iter(['new'] + ['deployment'] * 3 + ['operational'] * 2)
+
+        class StubCluster(object):
+            def get_status(self):
+                return {'status': next(statuses)}
+
+            def get_tasks_status(self):
+                return []
+
+        watcher = ClusterWatcher(StubCluster())
+        stime = time.time()
+        watcher.wait(lambda status, tasks: status['status'] == 'operational',
+                     10, "deploy")
+        assert time.time() - stime < 1
+    finally:
+        polling.POLICIES.update(saved_policies)
+
+
+if __name__ == "__main__":
+    test()
+    print "All tests pass OK"
@@ -0,0 +1,193 @@
+import time
+import select
+import socket
+import httplib
+import urlparse
+import threading
+
+
+class PooledResponse(object):
+    """HTTP response, which returns its connection to the pool
+    as soon as body is completely read
+    """
+
+    def __init__(self, response, release):
+        self.response = response
+        self.code = response.status
+        self.msg = response.reason
+        self.headers = response.msg
+        self._release = release
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def read(self, amt=None):
+        data = self.response.read(amt)
+        if self.response.isclosed() or (amt is not None and data == ''):
+            self.close()
+        return data
+
+    def close(self):
+        if self._release is not None:
+            release = self._release
+            self._release = None
+            release(self.response)
+
+
+class ConnectionPool(object):
+    """Keeps HTTP/1.1 keep-alive connections for reuse, per host
+
+    :param maxsize: max count of idle connections stored for each host
+    :param idle_timeout: idle connections older than this are closed
+    :param timeout: socket timeout for new connections
+    """
+
+    connection_classes = {'http': httplib.HTTPConnection,
+                          'https': httplib.HTTPSConnection}
+
+    # errors, which mean that server closed reused connection
+    reuse_errors = (httplib.BadStatusLine, httplib.CannotSendRequest,
+                    socket.error)
+
+    # methods, which are safe to send again, if response was lost;
+    # nailgun PUTs start actions (e.g. api/clusters/{id}/changes)
+    idempotent_methods = ('GET', 'HEAD', 'DELETE', 'OPTIONS')
+
+    def __init__(self, maxsize=8, idle_timeout=30, timeout=None):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.last_eviction = time.time()
+
+        self.connects = 0
+        self.reuses = 0
+        self.requests = 0
+
+    @staticmethod
+    def is_stale(conn):
+        """Idle connection is readable only if server closed it
+        or sent garbage, in both cases it can't be reused
+        """
+        if conn.sock is None:
+            return True
+        try:
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+        except (select.error, socket.error, ValueError):
+            return True
+        return bool(readable)
+
+    def get_connection(self, key):
+        """Returns (connection, reused) for (scheme, host, port) key"""
+        ctime = time.time()
+        self.evict_idle(ctime)
+        with self.lock:
+            idle = self.idle.get(key, [])
+            while idle:
+                conn, last_used = idle.pop()
+                if ctime - last_used < self.idle_timeout and \
+                        not self.is_stale(conn):
+                    self.reuses += 1
+                    return conn, True
+                conn.close()
+            self.connects += 1
+
+        scheme, host, port = key
+        conn_cls = self.connection_classes[scheme]
+        return conn_cls(host, port, timeout=self.timeout), False
+
+    def put_connection(self, key, conn):
+        self.evict_idle()
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def evict_idle(self, ctime=None):
+        """Close all connections, which are idle for too long
+
+        Called on each get/put, does nothing if previous eviction
+        was less than idle_timeout ago. get_connection takes newest
+        connections, so old ones would be never closed otherwise
+        """
+        if ctime is None:
+            ctime = time.time()
+
+        expired = []
+        with self.lock:
+            if ctime - self.last_eviction < self.idle_timeout:
+                return
+            self.last_eviction = ctime
+
+            for idle in self.idle.values():
+                # lists are ordered by last use time, oldest first
+                while idle and ctime - idle[0][1] >= self.idle_timeout:
+                    expired.append(idle.pop(0)[0])
+
+        for conn in expired:
+            conn.close()
+
+    def close(self):
+        with self.lock:
+            for idle in self.idle.values():
+                for conn, _ in idle:
+                    conn.close()
+            self.idle.clear()
+
+    def request(self, method, url, body=None, headers=None):
+        """Send request, reusing idle connection if possible
+
+        Returns PooledResponse, body should be read or response
+        should be closed to put connection back into pool
+        """
+        parsed = urlparse.urlsplit(url)
+        port = parsed.port
+        if port is None:
+            port = 443 if parsed.scheme == 'https' else 80
+        key = (parsed.scheme, parsed.hostname, port)
+
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+
+        conn, reused = self.get_connection(key)
+        sent = False
+        try:
+            conn.request(method, path, body, headers or {})
+            sent = True
+            response = conn.getresponse()
+        except self.reuse_errors:
+            conn.close()
+            # POST or PUT, which was sent, may be executed by server
+            if not reused or \
+                    (sent and method not in self.idempotent_methods):
+                raise
+            # server dropped keep-alive connection, retry once on new one
+            with self.lock:
+                self.connects += 1
+            conn = self.connection_classes[key[0]](key[1], key[2],
+                                                   timeout=self.timeout)
+            try:
+                conn.request(method, path, body, headers or {})
+                response = conn.getresponse()
+            except Exception:
+                conn.close()
+                raise
+        except Exception:
+            conn.close()
+            raise
+
+        with self.lock:
+            self.requests += 1
+
+        def release(resp):
+            if resp.will_close or not resp.isclosed():
+                conn.close()
+            else:
+                self.put_connection(key, conn)
+
+        return PooledResponse(response, release)
@@ -0,0 +1,89 @@
+import json
+
+
+WHITESPACE = ' \t\n\r'
+
+
+def iter_json_array(fd, chunk_size=64 * 1024):
+    """Incrementally decode top-level JSON array from file-like object
+
+    Yields array elements as soon as they are read, only one
+    undecoded element is kept in memory
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    started = False
+
+    while True:
+        # skip whitespace, array start and separators
+        while pos < len(buf):
+            char = buf[pos]
+            if char in WHITESPACE or (started and char == ','):
+                pos += 1
+            elif not started and char == '[':
+                started = True
+                pos += 1
+            else:
+                break
+
+        if pos < len(buf) and started and buf[pos] == ']':
+            return
+
+        if pos < len(buf) and not started:
+            raise ValueError("JSON array expected, got {!r}".format(buf[pos]))
+
+        if pos < len(buf):
+            try:
+                val, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+            else:
+                # number may be truncated, unless followed by delimiter
+                if eof or (end < len(buf) and buf[end] in WHITESPACE + ',]'):
+                    yield val
+                    pos = end
+                    continue
+
+        if eof:
+            raise ValueError("Unexpected end of JSON array")
+
+        chunk = fd.read(chunk_size)
+        if chunk == '':
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+
+def test():
+    from StringIO import StringIO
+
+    docs = [[], [1], [12345, -6.5e3, 7], ["a,]", "[", {"b": [1, 2]}],
+            [True, False, None, {"nested": {"x": "y ]"}}, [[], {}]]]
+
+    for doc in docs:
+        text = json.dumps(doc, indent=1)
+        # small chunks split numbers, literals and strings at each position
+        for chunk_size in (1, 2, 3, 5, 7, 64 * 1024):
+            assert list(iter_json_array(StringIO(text), chunk_size)) == doc
+        assert list(iter_json_array(StringIO(text.replace("\n", "")))) == doc
+
+    # number at the end of chunk isn't decoded until delimiter is seen
+    assert list(iter_json_array(StringIO("[12,345]"), 3)) == [12, 345]
+    assert list(iter_json_array(StringIO(" \n[ 1 , 2 ] "), 1)) == [1, 2]
+
+    for bad in ('{"a": 1}', '[1, 2', '[1, {"a": ]', ''):
+        for chunk_size in (1, 64 * 1024):
+            try:
+                list(iter_json_array(StringIO(bad), chunk_size))
+            except ValueError:
+                pass
+            else:
+                assert False, "{!r} accepted".format(bad)
+
+
+if __name__ == "__main__":
+    test()
+    print "All tests pass OK"
@@ -1,22 +1,34 @@
 import sys
+import copy
+import atexit
 import pprint
+import signal
+import threading
 import os.path
 import logging.config
 from optparse import OptionParser
 
-import yaml
+import polling
+import yaml_cache
+import token_manager
 import fuel_rest_api
 import cert_script as cs
+from http_pool import ConnectionPool
+from metrics import RequestMetrics
+from recording import RecordingPool, ReplayPool
+from response_cache import ResponseCache
 
 sys.path.insert(0, '../lib/requests')
 
 
 DEFAULT_CONFIG_PATH = 'config.yaml'
 
+# parsed config files, so warm start doesn't even import yaml
+config_cache = yaml_cache.YAMLCache()
+
 
 def parse_config(cfg_path):
-    with open(cfg_path) as f:
-        return yaml.load(f.read())
+    return config_cache.load(cfg_path)
 
 
 def parse_command_line():
@@ -57,6 +69,29 @@ def parse_command_line():
                            'environment1,environment2. Use ALL to delete all',
                       dest='delete', default=None)
 
+    parser.add_option('-P', '--parallel',
+                      help='count of test configs to run concurrently',
+                      dest='parallel', type='int', default=1)
+
+    parser.add_option('-m', '--metrics',
+                      help='store per route requests metrics to file, '
+                           'json if file name ends with .json, else '
+                           'prometheus text. SIGUSR1 stores them too',
+                      metavar='FILE', dest='metrics', default=None)
+
+    parser.add_option('--record',
+                      help='store all requests and responses to file',
+                      metavar='FILE', dest='record', default=None)
+
+    parser.add_option('--replay',
+                      help='serve responses from file, stored by --record, '
+                           'instead of using fuel',
+                      metavar='FILE', dest='replay', default=None)
+
+    parser.add_option('--replay-speed',
+                      help='time compression for --replay, 0 - no delays',
+                      dest='replay_speed', type='float', default=0)
+
     parser.add_option('-e', '--email',
                       help='email to send results. If not provided the results'
                            'will not be sent',
@@ -74,9 +109,7 @@ def merge_config(config, command_line):
 
 
 def setup_logger(config):
-    with open(config['log_settings']) as f:
-        cfg = yaml.load(f)
-
+    cfg = config_cache.load(config['log_settings'])
     logging.config.dictConfig(cfg)
 
     cs.set_logger(logging.getLogger('clogger'))
@@ -90,7 +123,8 @@ def deploy_single_cluster(args, clusters, conn, logger, auto_delete=True,
     file_exists = os.path.exists(cluster_name_or_file)
     if cluster_name_or_file.endswith('.yaml') and file_exists:
         try:
-            cluster = yaml.load(open(cluster_name_or_file).read())
+            cluster = yaml_cache.load_yaml_file(cluster_name_or_file)
+            cs.validate_cluster_template(cluster)
         except Exception:
             print "Failed to load cluster from {}".format(cluster_name_or_file)
             raise
@@ -109,6 +143,25 @@ def deploy_single_cluster(args, clusters, conn, logger, auto_delete=True,
     return 0
 
 
+def setup_metrics(fname):
+    """Returns RequestMetrics, which are stored to fname on exit
+    and on SIGUSR1
+    """
+    request_metrics = RequestMetrics()
+    atexit.register(request_metrics.dump, fname)
+
+    # signal handler may interrupt main thread inside record(), which
+    # holds metrics lock, so dump waits for the lock in other thread
+    def dump_in_thread(signum, frame):
+        thread = threading.Thread(target=request_metrics.dump, args=(fname,),
+                                  name='metrics-dump')
+        thread.daemon = True
+        thread.start()
+
+    signal.signal(signal.SIGUSR1, dump_in_thread)
+    return request_metrics
+
+
 def main():
     # prepare and config
     args = parse_command_line()
@@ -116,7 +169,35 @@ def main():
     merge_config(config, args)
     cfg_fname = config["gui_config_file"]
     setup_logger(config)
+    polling.configure(config.get('polling', {}))
     logger = logging.getLogger('clogger')
+    concurrency = config.get('http_concurrency', 8)
+    pool = ConnectionPool(config.get('http_pool_size', concurrency),
+                          config.get('http_idle_timeout', 30))
+
+    if args.get('replay') is not None:
+        pool = ReplayPool(args['replay'], args['replay_speed'])
+        polling.compress(args['replay_speed'])
+    elif args.get('record') is not None:
+        pool = RecordingPool(pool, args['record'])
+        atexit.register(pool.close)
+
+    cache = None
+    if config.get('http_cache') is not None:
+        cache_cfg = config['http_cache']
+        # longest pattern is the most specific one
+        ttls = sorted(cache_cfg.get('ttls', {}).items(),
+                      key=lambda (pattern, _): -len(pattern))
+        cache = ResponseCache(cache_cfg.get('maxsize', 256),
+                              cache_cfg.get('default_ttl', 5),
+                              ttls)
+
+    request_metrics = None
+    if args.get('metrics') is not None:
+        request_metrics = setup_metrics(args['metrics'])
+
+    compress = config.get('http_compress_requests')
+
     creds = args.get('creds')
     if creds:
         admin_node_ip = config['fuelurl'].split('/')[-1].split(':')[0]
@@ -124,30 +205,59 @@ def main():
                             if pair and "=" in pair])
         required_keys = ['username', 'password', 'tenant_name']
         if keyst_creds and all([key in keyst_creds for key in required_keys]):
+            token_cache_dir = config.get('token_cache_dir',
+                                         token_manager.DEFAULT_CACHE_DIR)
+            token_cache_dir = token_cache_dir or None
             conn = fuel_rest_api.KeystoneAuth(config['fuelurl'],
                                               creds=keyst_creds,
                                               echo=True,
-                                              admin_node_ip=admin_node_ip)
+                                              admin_node_ip=admin_node_ip,
+                                              pool=pool,
+                                              concurrency=concurrency,
+                                              cache=cache,
+                                              request_metrics=request_metrics,
+                                              compress_requests=compress,
+                                              token_cache_dir=token_cache_dir)
         else:
             raise Exception("Invalid auth credentials")
     else:
-        conn = fuel_rest_api.Urllib2HTTP(config['fuelurl'], echo=True)
+        conn = fuel_rest_api.Urllib2HTTP(config['fuelurl'], echo=True,
+                                         pool=pool, concurrency=concurrency,
+                                         cache=cache,
+                                         request_metrics=request_metrics,
+                                         compress_requests=compress)
+
+    atexit.register(lambda: logger.info("HTTP transfer: {}".format(
+        conn.transfer)))
 
     test_run_timeout = config.get('testrun_timeout', 3600)
 
     path = os.path.join(os.path.dirname(DEFAULT_CONFIG_PATH),
                         config['tests']['clusters_directory'])
 
-    clusters = cs.load_all_clusters(path)
+    cache_dir = config.get('template_cache_dir',
+                           yaml_cache.DEFAULT_CACHE_DIR)
+    cache = yaml_cache.YAMLCache(cache_dir) if cache_dir else None
+    clusters = cs.TemplateLoader(path, cache)
 
     clusters_to_delete = args.get('delete')
     if clusters_to_delete:
-        if clusters_to_delete == "ALL":
-            cs.delete_all_clusters(conn)
-        else:
-            for cl_name in clusters_to_delete.split(','):
-                cs.delete_if_exists(conn, cl_name)
-        return
+        clusters = list(fuel_rest_api.get_all_clusters(conn))
+        if clusters_to_delete != "ALL":
+            names = clusters_to_delete.split(',')
+            clusters = [cluster for cluster in clusters
+                        if cluster.name in names]
+
+        outcomes = cs.delete_clusters(conn, clusters,
+                                      config.get('delete_concurrency'),
+                                      config.get('delete_timeout', 60))
+        for name, error in sorted(outcomes.items()):
+            print "{}: {}".format(name, "deleted" if error is None
+                                  else "failed - {}".format(error))
+
+        if any(error is not None for error in outcomes.values()):
+            return 1
+        return 0
 
     saved_cfg = None
     if args.get('reuse_config') is True:
@@ -172,40 +282,135 @@ def main():
                 cs.store_config(cfg, cfg_fname)
         return 0
 
+    # every template should be valid before first cluster is deployed
     tests_cfg = config['tests']['tests']
-    for _, test_cfg in tests_cfg.iteritems():
-        cluster = clusters[test_cfg['cluster']]
-
-        tests_to_run = test_cfg['suits']
-
-        cont_man = cs.make_cluster(conn,
-                                   cluster,
-                                   auto_delete=True,
-                                   additional_cfg=saved_cfg)
-
-        with cont_man as cluster_id:
-            results = cs.run_all_tests(conn,
-                                       cluster_id,
-                                       test_run_timeout,
-                                       tests_to_run)
-
-            tests = []
-            for testset in results:
-                tests.extend(testset['tests'])
-
-            failed_tests = [test for test in tests
-                            if test['status'] == 'failure']
-
-            for test in failed_tests:
-                logger.debug(test['name'])
-                logger.debug(" "*10 + 'Failure message: '
-                             + test['message'])
-
-            email_for_results = args.get("email")
-            if email_for_results:
-                cs.send_results(email_for_results, tests)
+    try:
+        clusters = clusters.require(test_cfg.get('cluster')
+                                    for test_cfg in tests_cfg.values())
+    except ValueError as exc:
+        logger.fatal("Error: {}".format(exc))
+        return 1
+
+    test_options = {}
+    if config.get('ostf_concurrency') is not None:
+        test_options['concurrency'] = config['ostf_concurrency']
+    if config.get('ostf_exclusive_tests') is not None:
+        test_options['exclusive_tests'] = config['ostf_exclusive_tests']
+
+    results = run_tests_matrix(conn, clusters, tests_cfg, args,
+                               test_run_timeout, saved_cfg,
+                               args.get('parallel', 1), test_options)
+
+    exit_code = 0
+    for name, result in sorted(results.items()):
+        failed = [test for test in result['tests']
+                  if test['status'] == 'failure']
+        if result['error'] is not None:
+            logger.error("{}: {}".format(name, result['error']))
+            exit_code = 1
+        else:
+            logger.info("{}: {} tests, {} failed".format(
+                name, len(result['tests']), len(failed)))
+
+    return exit_code
+
+
+class ClusterLogger(logging.LoggerAdapter):
+    """Prefix messages with name of test config"""
+
+    def process(self, msg, kwargs):
+        return "[{}] {}".format(self.extra['name'], msg), kwargs
+
+
+def run_test_config(conn, name, test_cfg, cluster, args, test_run_timeout,
+                    saved_cfg, reservations, test_options=None):
+    """Deploy cluster for test config and run its suits
+
+    :param test_options: dict of options for test classes
+
+    Returns dict with tests results and error, if any
+    """
+    logger = ClusterLogger(logging.getLogger('clogger'), {'name': name})
+    result = {'cluster': cluster['name'], 'tests': [], 'error': None}
+
+    tests_to_run = test_cfg['suits']
+
+    cont_man = cs.make_cluster(conn,
+                               cluster,
+                               auto_delete=True,
+                               additional_cfg=saved_cfg,
+                               reservations=reservations)
+
+    try:
+        with cont_man as cluster_obj:
+            try:
+                results = cs.run_all_tests(conn,
+                                           cluster_obj.id,
+                                           test_run_timeout,
+                                           tests_to_run,
+                                           test_options)
+                for testset in results:
+                    result['tests'].extend(testset['tests'])
+            except Exception as exc:
+                result['error'] = str(exc)
+                raise
+    except Exception as exc:
+        logger.exception("Failed to deploy cluster")
+        result['error'] = str(exc)
+
+    failed_tests = [test for test in result['tests']
+                    if test['status'] == 'failure']
+
+    for test in failed_tests:
+        logger.debug(test['name'])
+        logger.debug(" "*10 + 'Failure message: '
+                     + test['message'])
+
+    email_for_results = args.get("email")
+    if email_for_results:
+        # mail failure shouldn't lose results of this and other configs
+        try:
+            cs.send_results(email_for_results, result['tests'])
+        except Exception:
+            logger.exception("Failed to send results by email")
+
+    return result
+
+
+def run_tests_matrix(conn, clusters, tests_cfg, args, test_run_timeout,
+                     saved_cfg, parallel=1, test_options=None):
+    """Run all test configs, up to parallel of them concurrently
+
+    Concurrent deployments take disjoint sets of free nodes and wait
+    for more nodes, if all are taken. Returns dict test name -> result
+
+    :param clusters: dict name -> template, should contain templates
+                     of all configs, see TemplateLoader.require
+    """
+    reservations = cs.NodeReservations()
+
+    def run(name_and_cfg):
+        name, test_cfg = name_and_cfg
+        cluster = copy.deepcopy(clusters[test_cfg['cluster']])
+        if parallel > 1:
+            # clusters with same name would delete each other
+            cluster['name'] = "{}-{}".format(cluster['name'], name)
+            threading.current_thread().name = name
+        return name, run_test_config(conn, name, test_cfg, cluster, args,
+                                     test_run_timeout, saved_cfg,
+                                     reservations, test_options)
+
+    to_run = sorted(tests_cfg.items())
+    if parallel > 1:
+        from multiprocessing.pool import ThreadPool
+        workers = ThreadPool(parallel)
+        try:
+            # map without timeout ignores KeyboardInterrupt
+            return dict(workers.map_async(run, to_run).get(1E9))
+        finally:
+            workers.close()
 
-    return 0
+    return dict(map(run, to_run))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,265 @@
+import re
+import json
+import threading
+import contextlib
+
+
+# latency histogram upper bounds, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0, float('inf'))
+
+NO_PHASE = '-'
+
+local = threading.local()
+
+
+def current_phase():
+    return getattr(local, 'phase', NO_PHASE)
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Label requests, made by current thread, with phase name"""
+    prev_phase = current_phase()
+    local.phase = name
+    try:
+        yield
+    finally:
+        local.phase = prev_phase
+
+
+def run_in_phase(phase_name, func, *args):
+    """Call func in phase, for functions, executed in other thread"""
+    with phase(phase_name):
+        return func(*args)
+
+
+class RouteStats(object):
+    def __init__(self):
+        self.count = 0
+        self.codes = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency_sum = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def to_dict(self):
+        return {'count': self.count,
+                'codes': dict((str(code), cnt)
+                              for code, cnt in self.codes.items()),
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'latency_sum': self.latency_sum,
+                'latency_buckets': [
+                    ['+Inf' if bound == float('inf') else bound, cnt]
+                    for bound, cnt in zip(LATENCY_BUCKETS, self.buckets)]}
+
+
+class RequestMetrics(object):
+    """Per route request counters and latency histograms
+
+    Routes are url templates, like api/clusters/{id}, so requests
+    to different objects are accounted together
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def record(self, method, route, code, bytes_out, bytes_in, latency):
+        """Account single request, code is None if no response received"""
+        key = (current_phase(), method.upper(), route)
+        with self.lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = RouteStats()
+
+            stats.count += 1
+            code = 'error' if code is None else code
+            stats.codes[code] = stats.codes.get(code, 0) + 1
+            stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+            stats.latency_sum += latency
+            for pos, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    stats.buckets[pos] += 1
+                    break
+
+    def to_json(self):
+        with self.lock:
+            res = [dict(phase=key[0], method=key[1], route=key[2],
+                        **stats.to_dict())
+                   for key, stats in sorted(self.stats.items())]
+        return json.dumps(res, indent=4, sort_keys=True)
+
+    def to_prometheus(self):
+        """Metrics in prometheus text exposition format
+
+        Samples of each metric family are grouped after its TYPE line
+        """
+        with self.lock:
+            stats = [(key, copy_stats(route_stats))
+                     for key, route_stats in sorted(self.stats.items())]
+
+        def labels(phase_name, method, route):
+            return 'phase="{}",method="{}",route="{}"'.format(
+                escape(phase_name), method, escape(route))
+
+        lines = ['# TYPE fuel_http_requests_total counter']
+        for key, route_stats in stats:
+            for code, cnt in sorted(route_stats.codes.items()):
+                lines.append('fuel_http_requests_total{{{},code="{}"}} {}'
+                             .format(labels(*key), code, cnt))
+
+        lines.append('# TYPE fuel_http_sent_bytes_total counter')
+        for key, route_stats in stats:
+            lines.append('fuel_http_sent_bytes_total{{{}}} {}'
+                         .format(labels(*key), route_stats.bytes_out))
+
+        lines.append('# TYPE fuel_http_received_bytes_total counter')
+        for key, route_stats in stats:
+            lines.append('fuel_http_received_bytes_total{{{}}} {}'
+                         .format(labels(*key), route_stats.bytes_in))
+
+        lines.append('# TYPE fuel_http_request_duration_seconds histogram')
+        for key, route_stats in stats:
+            # prometheus buckets are cumulative
+            total = 0
+            for bound, cnt in zip(LATENCY_BUCKETS, route_stats.buckets):
+                total += cnt
+                bound = '+Inf' if bound == float('inf') else bound
+                lines.append(
+                    'fuel_http_request_duration_seconds_bucket'
+                    '{{{},le="{}"}} {}'.format(labels(*key), bound, total))
+
+            lines.append('fuel_http_request_duration_seconds_sum{{{}}} {}'
+                         .format(labels(*key), route_stats.latency_sum))
+            lines.append('fuel_http_request_duration_seconds_count{{{}}} {}'
+                         .format(labels(*key), route_stats.count))
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self, fname):
+        """Store metrics to file, json if fname ends with .json,
+        else prometheus text
+        """
+        if fname.endswith('.json'):
+            data = self.to_json()
+        else:
+            data = self.to_prometheus()
+
+        with open(fname, 'w') as fd:
+            fd.write(data)
+
+
+class MeteredResponse(object):
+    """Counts bytes of response body as they are read, calls
+    on_done(bytes_read) once, when body is read to the end or closed
+    """
+
+    def __init__(self, response, on_done):
+        self.response = response
+        self.code = response.code
+        self.msg = response.msg
+        self.headers = response.headers
+        self.on_done = on_done
+        self.bytes_read = 0
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def read(self, amt=None):
+        data = self.response.read(amt)
+        self.bytes_read += len(data)
+        if amt is None or data == '':
+            self.done()
+        return data
+
+    def done(self):
+        if self.on_done is not None:
+            on_done = self.on_done
+            self.on_done = None
+            on_done(self.bytes_read)
+
+    def close(self):
+        self.response.close()
+        self.done()
+
+
+def copy_stats(stats):
+    res = RouteStats()
+    res.__dict__.update(stats.__dict__)
+    res.codes = dict(stats.codes)
+    res.buckets = list(stats.buckets)
+    return res
+
+
+def escape(val):
+    return val.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def make_route_rr(url):
+    """Compile url template into regex, matching formatted urls"""
+    parts = re.split(r"\{[a-zA-Z_]+\}", url.lstrip('/'))
+    return re.compile("^" + "[^/?&]+".join(map(re.escape, parts)) + "$")
+
+
+id_rr = re.compile(r"(?<=/)\d+(?=/|$|\?)")
+query_val_rr = re.compile(r"=[^&]*")
+
+
+def generic_route(path):
+    """Template for url, which doesn't match any known route"""
+    path = id_rr.sub("{id}", path.lstrip('/'))
+    return query_val_rr.sub("={}", path)
+
+
+def test():
+    request_metrics = RequestMetrics()
+    request_metrics.record('get', 'api/nodes', 200, 0, 100, 0.02)
+    request_metrics.record('get', 'api/nodes', 500, 0, 10, 3)
+    with phase('deploy'):
+        request_metrics.record('put', 'api/clusters/{id}/changes', 202,
+                               10, 5, 0.3)
+        request_metrics.record('get', 'api/"x"', None, 0, 0, 0.001)
+
+    # every family should be single group, right after its TYPE line
+    families = []
+    samples = {}
+    for line in request_metrics.to_prometheus().splitlines():
+        if line.startswith('# TYPE '):
+            _, _, name, kind = line.split()
+            assert name not in samples, "Duplicated family " + name
+            families.append(name)
+            samples[name] = []
+            continue
+
+        match = re.match(r'^([a-z_]+)\{(.*)\} (\S+)$', line)
+        assert match is not None, "Bad sample line " + line
+        name, labels, val = match.groups()
+        family = families[-1]
+        if kind == 'histogram':
+            assert name in (family + '_bucket', family + '_sum',
+                            family + '_count'), line
+        else:
+            assert name == family, line
+        float(val)
+        samples[family].append(labels)
+
+    assert families == ['fuel_http_requests_total',
+                        'fuel_http_sent_bytes_total',
+                        'fuel_http_received_bytes_total',
+                        'fuel_http_request_duration_seconds']
+    assert len(samples['fuel_http_requests_total']) == 4
+    assert len(samples['fuel_http_sent_bytes_total']) == 3
+    assert any('route="api/\\"x\\""' in labels
+               for labels in samples['fuel_http_sent_bytes_total'])
+    assert len(samples['fuel_http_request_duration_seconds']) == \
+        3 * (len(LATENCY_BUCKETS) + 2)
+
+    assert len(json.loads(request_metrics.to_json())) == 3
+
+
+if __name__ == "__main__":
+    test()
+    print "All tests pass OK"
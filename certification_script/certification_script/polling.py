@@ -0,0 +1,142 @@
+import time
+import heapq
+import random
+
+
+class PollPolicy(object):
+    """How often to poll: interval starts from min_interval and grows
+    by backoff factor on each unsuccessful check up to max_interval,
+    each interval is randomly changed by up to jitter fraction
+    """
+
+    def __init__(self, min_interval=1, max_interval=10, backoff=1.5,
+                 jitter=0.1):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+
+    def intervals(self):
+        interval = self.min_interval
+        while True:
+            delta = interval * self.jitter
+            yield interval + random.uniform(-delta, delta)
+            interval = min(interval * self.backoff, self.max_interval)
+
+
+POLICIES = {
+    'default': PollPolicy(1, 10),
+    # deploy is long, but finish should be noticed quickly
+    'deploy': PollPolicy(5, 15),
+    'delete': PollPolicy(0.5, 5),
+    'ostf': PollPolicy(2, 30),
+    'discovery': PollPolicy(1, 10),
+}
+
+
+def get_policy(policy):
+    if policy is None:
+        return POLICIES['default']
+    if isinstance(policy, PollPolicy):
+        return policy
+    return POLICIES[policy]
+
+
+def configure(policies_cfg):
+    """Update policies from config dict name -> PollPolicy params"""
+    for name, params in policies_cfg.items():
+        POLICIES[name] = PollPolicy(**params)
+
+
+def compress(speed):
+    """Divide all poll intervals by speed, 0 means poll without delays
+
+    Used to replay recorded runs faster than real time
+    """
+    factor = 1.0 / speed if speed else 0
+    for name, policy in POLICIES.items():
+        POLICIES[name] = PollPolicy(policy.min_interval * factor,
+                                    policy.max_interval * factor,
+                                    policy.backoff, policy.jitter)
+
+
+class PollTask(object):
+    """Single wait, scheduled in Poller"""
+
+    def __init__(self, predicate, timeout, message, policy, callback=None):
+        self.predicate = predicate
+        self.callback = callback
+        self.message = message
+        self.deadline = time.time() + timeout
+        self.intervals = get_policy(policy).intervals()
+        self.next_time = time.time()
+        self.checks = 0
+        self.done = False
+        self.error = None
+
+    def check(self):
+        """Call predicate, returns True if task is finished"""
+        self.checks += 1
+        try:
+            if self.predicate():
+                self.done = True
+                return True
+        except Exception as exc:
+            self.error = exc
+            return True
+
+        ctime = time.time()
+        if ctime >= self.deadline:
+            self.error = RuntimeError("Timeout during " + self.message)
+            return True
+
+        self.next_time = min(ctime + next(self.intervals), self.deadline)
+        return False
+
+    def get(self):
+        """Reraise error, if wait failed"""
+        if self.error is not None:
+            # pylint can't see that error is not None here
+            raise self.error  # pylint: disable=raising-bad-type
+        return self.done
+
+
+class Poller(object):
+    """Runs many waits in one thread, each with own policy"""
+
+    def __init__(self):
+        self.queue = []
+        self.tasks = []
+
+    def add(self, predicate, timeout, message, policy=None, callback=None):
+        """Schedule wait until predicate() returns True
+
+        predicate exception or timeout finishes the wait with error.
+        callback(task) is called, when wait is finished, it may add
+        new waits to this poller
+        """
+        task = PollTask(predicate, timeout, message, policy, callback)
+        self.tasks.append(task)
+        heapq.heappush(self.queue, (task.next_time, len(self.tasks), task))
+        return task
+
+    def run(self):
+        """Run until all waits are finished, returns tasks"""
+        while self.queue:
+            next_time, order, task = heapq.heappop(self.queue)
+            sleep_time = next_time - time.time()
+            if sleep_time > 0:
+                time.sleep(sleep_time)
+            if not task.check():
+                heapq.heappush(self.queue, (task.next_time, order, task))
+            elif task.callback is not None:
+                task.callback(task)
+        return self.tasks
+
+
+def wait(predicate, timeout, message, policy=None):
+    """Wait until predicate() returns True, raise RuntimeError on timeout"""
+    poller = Poller()
+    task = poller.add(predicate, timeout, message, policy)
+    poller.run()
+    task.get()
@@ -0,0 +1,140 @@
+import gzip
+import json
+import time
+import urlparse
+import threading
+import collections
+from StringIO import StringIO
+
+
+def request_path(url):
+    """Path with query, so recording doesn't depend on fuel address"""
+    parsed = urlparse.urlsplit(url)
+    path = parsed.path or '/'
+    if parsed.query:
+        path += '?' + parsed.query
+    return path
+
+
+def decode_body(body):
+    """Request body as stored in recording, it may be gzipped"""
+    return body.decode('latin-1') if body is not None else None
+
+
+class ReplayResponse(object):
+    """Completely read HTTP response, same interface as PooledResponse"""
+
+    def __init__(self, code, msg, headers, content):
+        self.code = code
+        self.msg = msg
+        self.headers = headers
+        self.body = StringIO(content)
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    def read(self, amt=None):
+        if amt is None:
+            return self.body.read()
+        return self.body.read(amt)
+
+    def close(self):
+        pass
+
+
+class RecordingPool(object):
+    """Wraps ConnectionPool and stores all requests with responses
+    and timings to gzipped file, one JSON object per line
+    """
+
+    def __init__(self, pool, fname):
+        self.pool = pool
+        self.fd = gzip.open(fname, 'wb')
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.records = 0
+
+    def request(self, method, url, body=None, headers=None):
+        stime = time.time()
+        response = self.pool.request(method, url, body, headers)
+        content = response.read()
+        latency = time.time() - stime
+
+        headers = dict((name.lower(), val)
+                       for name, val in response.headers.items())
+
+        # latin-1 maps any byte string to unicode and back unchanged
+        record = {'t': stime - self.start_time,
+                  'latency': latency,
+                  'method': method,
+                  'path': request_path(url),
+                  'body': decode_body(body),
+                  'code': response.code,
+                  'msg': response.msg,
+                  'headers': headers,
+                  'content': content.decode('latin-1')}
+
+        with self.lock:
+            self.fd.write(json.dumps(record) + "\n")
+            self.records += 1
+
+        return ReplayResponse(response.code, response.msg, headers, content)
+
+    def close(self):
+        with self.lock:
+            self.fd.close()
+
+
+class ReplayError(LookupError):
+    pass
+
+
+class ReplayPool(object):
+    """Serves responses from RecordingPool file instead of Fuel
+
+    Requests are matched by method, path and body (or only by method
+    and path, if there is no exact match). Responses to the same
+    request are returned in recorded order, last one is repeated,
+    so status polling loops finish as they did during recording.
+
+    :param speed: time compression, recorded latencies are divided
+                  by speed, 0 means no delays at all
+    """
+
+    def __init__(self, fname, speed=0):
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.exact = collections.defaultdict(collections.deque)
+        self.by_path = collections.defaultdict(collections.deque)
+        self.requests = 0
+
+        with gzip.open(fname, 'rb') as fd:
+            for line in fd:
+                record = json.loads(line)
+                key = (record['method'], record['path'])
+                self.exact[key + (record['body'],)].append(record)
+                self.by_path[key].append(record)
+
+    def next_record(self, method, path, body):
+        with self.lock:
+            self.requests += 1
+            for records in (self.exact.get((method, path, body)),
+                            self.by_path.get((method, path))):
+                if records:
+                    if len(records) > 1:
+                        return records.popleft()
+                    return records[0]
+
+        raise ReplayError("No recorded response for {} {}".format(method,
+                                                                  path))
+
+    def request(self, method, url, body=None, headers=None):
+        record = self.next_record(method, request_path(url),
+                                  decode_body(body))
+
+        if self.speed:
+            time.sleep(record['latency'] / self.speed)
+
+        return ReplayResponse(record['code'], record['msg'],
+                              record['headers'],
+                              record['content'].encode('latin-1'))
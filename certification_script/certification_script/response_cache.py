@@ -0,0 +1,85 @@
+import copy
+import time
+import fnmatch
+import threading
+from collections import OrderedDict
+
+
+def split_path(path):
+    """Returns resource path (without query) as list of segments"""
+    return path.split('?', 1)[0].strip('/').split('/')
+
+
+class ResponseCache(object):
+    """LRU cache for GET responses with per-endpoint TTL
+
+    :param maxsize: max count of cached responses
+    :param default_ttl: TTL in seconds for paths not matched by ttls
+    :param ttls: list of (fnmatch pattern, ttl) pairs, first match wins,
+                 ttl == 0 disables caching for path
+    """
+
+    def __init__(self, maxsize=256, default_ttl=5, ttls=()):
+        self.maxsize = maxsize
+        self.default_ttl = default_ttl
+        self.ttls = [(pattern.strip('/'), ttl) for pattern, ttl in ttls]
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_ttl(self, path):
+        path = path.strip('/')
+        for pattern, ttl in self.ttls:
+            if fnmatch.fnmatchcase(path, pattern):
+                return ttl
+        return self.default_ttl
+
+    def get(self, method, path):
+        """Returns (found, value)"""
+        key = (method, path.strip('/'))
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[0] > time.time():
+                # move to the end - most recently used
+                self.entries[key] = entry
+                self.hits += 1
+                return True, copy.deepcopy(entry[1])
+            self.misses += 1
+            return False, None
+
+    def put(self, method, path, value):
+        ttl = self.get_ttl(path)
+        if ttl <= 0:
+            return
+
+        key = (method, path.strip('/'))
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + ttl, copy.deepcopy(value))
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, path):
+        """Drop responses for resource path, its parents and children"""
+        wpath = split_path(path)
+        with self.lock:
+            for key in self.entries.keys():
+                cpath = split_path(key[1])
+                common = min(len(cpath), len(wpath))
+                if cpath[:common] == wpath[:common]:
+                    del self.entries[key]
+                    self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'size': len(self.entries)}
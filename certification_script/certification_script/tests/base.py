@@ -1,10 +1,11 @@
 
 class BaseTests(object):
 
-    def __init__(self, conn, cluster_id, timeout):
+    def __init__(self, conn, cluster_id, timeout, options=None):
         self.conn = conn
         self.cluster_id = cluster_id
         self.timeout = timeout
+        self.options = options if options is not None else {}
 
     def run_tests(self, tests):
         raise NotImplementedError()
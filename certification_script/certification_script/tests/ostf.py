@@ -1,30 +1,74 @@
 import base
-from fuel_rest_api import with_timeout
+from fuel_rest_api import with_timeout, gather
 
 
 class OSTFTests(base.BaseTests):
+    """Runs OSTF testsets
+
+    options 'concurrency' and 'exclusive_tests' override class defaults
+    """
+
+    # max count of testsets, running at the same time
+    concurrency = 4
+
+    # testsets, which should not run together with any other testset
+    exclusive_tests = ('ha', 'platform_tests')
+
+    def __init__(self, conn, cluster_id, timeout, options=None):
+        super(OSTFTests, self).__init__(conn, cluster_id, timeout, options)
+        self.concurrency = self.options.get('concurrency', self.concurrency)
+        self.exclusive_tests = tuple(self.options.get('exclusive_tests',
+                                                      self.exclusive_tests))
 
     def run_test(self, test_name):
-        data = {'testset': test_name,
-                'tests': [],
-                'metadata': {'cluster_id': self.cluster_id}}
+        return self.run_testsets([test_name])
+
+    def run_testsets(self, test_names):
+        """Start several testsets with one request"""
+        data = [{'testset': test_name,
+                 'tests': [],
+                 'metadata': {'cluster_id': self.cluster_id}}
+                for test_name in test_names]
+
+        return self.conn.post('ostf/testruns', data)
+
+    def make_batches(self, tests):
+        """Split tests into groups, which can run concurrently"""
+        tests = sorted(tests)
+        shared = [test for test in tests if test not in self.exclusive_tests]
+        exclusive = [test for test in tests if test in self.exclusive_tests]
 
-        return self.conn.post('ostf/testruns', [data])
+        batches = []
+        for pos in range(0, len(shared), self.concurrency):
+            batches.append(shared[pos:pos + self.concurrency])
+        batches.extend([test] for test in exclusive)
+        return batches
 
     def run_tests(self, tests):
-        for test_name in tests:
-            print test_name
+        for batch in self.make_batches(tests):
+            print batch
 
-            run_id = self.run_test(test_name)[0]['id']
+            run_ids = [run['id'] for run in self.run_testsets(batch)]
+            finished = {}
 
-            def check_ready(self, run_id):
-                status = self.conn.get('/ostf/testruns/{}'.format(run_id))
-                return status['status'] == 'finished'
+            def check_ready():
+                pending = [run_id for run_id in run_ids
+                           if run_id not in finished]
+                statuses = gather([
+                    self.conn.do_async('get',
+                                       '/ostf/testruns/{}'.format(run_id))
+                    for run_id in pending])
+                for run_id, status in zip(pending, statuses):
+                    if status['status'] == 'finished':
+                        finished[run_id] = status
+                return len(finished) == len(run_ids)
 
-            wt = with_timeout(self.timeout, "run test " + test_name)
-            wt(check_ready)(self, run_id)
+            wt = with_timeout(self.timeout, "run tests " + ", ".join(batch),
+                              'ostf')
+            wt(check_ready)()
 
-            yield self.conn.get('/ostf/testruns/{}'.format(run_id))
+            for run_id in run_ids:
+                yield finished[run_id]
 
     def get_available_tests(self):
         testsets = self.conn.get('/ostf/testsets/{}'.format(self.cluster_id))
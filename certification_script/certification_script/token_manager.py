@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import threading
+
+from atomic_file import write_atomic
+
+
+DEFAULT_CACHE_DIR = os.path.expanduser('~/.cache/fuel_cert/tokens')
+
+
+class TokenManager(object):
+    """Keeps auth token valid, sharing it between threads and processes
+
+    Token is refreshed in background thread when it's going to expire
+    in less than refresh_margin seconds, only one refresh runs at a time.
+    Valid token is stored in cache_file (mode 0600) and reused by next
+    CLI invocations
+
+    :param authenticate: callable, returns (token, expiration unix time),
+                         expiration may be None if unknown, token may
+                         be None if authentication failed
+    :param cache_file: file to keep token between runs, None - don't keep
+    :param refresh_margin: seconds before expiration to start refresh
+    :param default_ttl: token lifetime, if authenticate doesn't know it
+    """
+
+    def __init__(self, authenticate, cache_file=None, refresh_margin=300,
+                 default_ttl=3600):
+        self.authenticate = authenticate
+        self.cache_file = cache_file
+        self.refresh_margin = refresh_margin
+        self.default_ttl = default_ttl
+
+        self.token = None
+        self.expires = 0
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.refresh_thread = None
+        self.refreshes = 0
+
+        self.load()
+
+    def get_token(self):
+        """Returns valid token, waits for refresh only if token expired"""
+        ctime = time.time()
+        with self.lock:
+            token, expires = self.token, self.expires
+
+        if token is None or ctime >= expires:
+            return self.refresh(token)
+
+        if ctime >= expires - self.refresh_margin:
+            self.refresh_async(token)
+
+        return token
+
+    def invalidate(self, token):
+        """Token was rejected by server, returns new one"""
+        return self.refresh(token)
+
+    def refresh(self, old_token):
+        """Get new token, unless somebody already replaced old_token
+
+        Concurrent callers wait for single authentication
+        """
+        with self.refresh_lock:
+            with self.lock:
+                if self.token is not None and self.token != old_token:
+                    return self.token
+
+            token, expires = self.authenticate()
+            self.refreshes += 1
+            if token is None:
+                return None
+
+            if expires is None:
+                expires = time.time() + self.default_ttl
+
+            with self.lock:
+                self.token, self.expires = token, expires
+
+            self.store()
+            return token
+
+    def refresh_async(self, old_token):
+        with self.lock:
+            if self.refresh_thread is not None:
+                return
+            self.refresh_thread = threading.Thread(
+                target=self.background_refresh, args=(old_token,),
+                name='token-refresh')
+            self.refresh_thread.daemon = True
+
+        self.refresh_thread.start()
+
+    def background_refresh(self, old_token):
+        try:
+            self.refresh(old_token)
+        except Exception:
+            # current token is still valid, next get_token would retry
+            pass
+        finally:
+            with self.lock:
+                self.refresh_thread = None
+
+    def load(self):
+        if self.cache_file is None:
+            return
+
+        try:
+            with open(self.cache_file) as fd:
+                data = json.load(fd)
+        except (IOError, ValueError):
+            return
+
+        if data.get('expires', 0) > time.time():
+            self.token, self.expires = data['token'], data['expires']
+
+    def store(self):
+        if self.cache_file is None or self.token is None:
+            return
+
+        # file is created with 0600 mode, only owner can read token
+        token, expires = self.token, self.expires
+        write_atomic(self.cache_file,
+                     lambda fd: json.dump({'token': token,
+                                           'expires': expires}, fd),
+                     dir_mode=0700)
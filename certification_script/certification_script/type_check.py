@@ -1,10 +1,25 @@
 import functools
 
 
+class CheckError(AssertionError):
+    """Value doesn't match type description
+
+    path is list of keys/indexes from checked value to wrong one
+    """
+    def __init__(self, path, message):
+        self.path = path
+        where = "".join("[{!r}]".format(key) for key in path) or "value"
+        super(CheckError, self).__init__("{}: {}".format(where, message))
+
+
 def match_base_type(tp, val):
     return type(val) is tp
 
 
+def match_string(val):
+    return isinstance(val, basestring)
+
+
 def any_matcher(_):
     return True
 
@@ -48,6 +63,26 @@ def match_dict(key_matcher, val_matcher, val):
     return True
 
 
+def match_struct(required, optional, extra, val):
+    if not isinstance(val, dict):
+        return False
+
+    for key, matcher in required.items():
+        if key not in val or not matcher(val[key]):
+            return False
+
+    for key, matcher in optional.items():
+        if key in val and not matcher(val[key]):
+            return False
+
+    if not extra:
+        for key in val:
+            if key not in required and key not in optional:
+                return False
+
+    return True
+
+
 class Any(object):
     pass
 
@@ -56,18 +91,40 @@ class NoneOr(object):
     def __init__(self, inner):
         self.inner = inner
 
+
+class Struct(object):
+    """dict with known keys
+
+    :param required: dict key -> type description of value
+    :param optional: same, for keys, which may be absent
+    :param extra: allow keys, not listed in required and optional
+    """
+    def __init__(self, required, optional=None, extra=True):
+        self.required = required
+        self.optional = optional if optional is not None else {}
+        self.extra = extra
+
+
 type_map = {}
 
 for _tp in (int, str, unicode, bool, float):
     type_map[_tp] = functools.partial(match_base_type, _tp)
 
 
+type_map[basestring] = match_string
 type_map[Any] = any_matcher
 
 
 def descr2matcher(descr):
-    if descr is NoneOr:
-        return functools.partial(none_or, descr.inner)
+    if isinstance(descr, NoneOr):
+        return functools.partial(none_or, descr2matcher(descr.inner))
+    elif isinstance(descr, Struct):
+        required = dict((key, descr2matcher(val))
+                        for key, val in descr.required.items())
+        optional = dict((key, descr2matcher(val))
+                        for key, val in descr.optional.items())
+        return functools.partial(match_struct, required, optional,
+                                 descr.extra)
     elif isinstance(descr, (list, tuple)):
         if len(descr) != 1:
             raise ValueError("List in type description should be len 1")
@@ -90,8 +147,198 @@ def descr2matcher(descr):
         raise ValueError(msg)
 
 
+# ------------------------- code generation ----------------------------------
+
+
+class CodeGen(object):
+    """Generates flat python function, returning False on mismatch"""
+
+    def __init__(self):
+        self.lines = []
+        self.consts = {}
+        self.var_count = 0
+
+    def new_var(self, prefix):
+        self.var_count += 1
+        return "{}{}".format(prefix, self.var_count)
+
+    def const(self, val):
+        name = self.new_var('c')
+        self.consts[name] = val
+        return name
+
+    def emit(self, indent, line):
+        self.lines.append("    " * indent + line)
+
+    def gen(self, descr, var, indent):
+        if isinstance(descr, NoneOr):
+            self.emit(indent, "if {} is not None:".format(var))
+            self.emit(indent + 1, "pass")
+            self.gen(descr.inner, var, indent + 1)
+        elif isinstance(descr, Struct):
+            self.emit(indent, "if not isinstance({}, dict):".format(var))
+            self.emit(indent + 1, "return False")
+            for key, val_descr in sorted(descr.required.items()):
+                key_const = self.const(key)
+                self.emit(indent, "if {} not in {}:".format(key_const, var))
+                self.emit(indent + 1, "return False")
+                field = self.new_var('f')
+                self.emit(indent, "{} = {}[{}]".format(field, var, key_const))
+                self.gen(val_descr, field, indent)
+            for key, val_descr in sorted(descr.optional.items()):
+                key_const = self.const(key)
+                field = self.new_var('f')
+                self.emit(indent, "if {} in {}:".format(key_const, var))
+                self.emit(indent + 1, "{} = {}[{}]".format(field, var,
+                                                           key_const))
+                self.gen(val_descr, field, indent + 1)
+            if not descr.extra:
+                known = self.const(frozenset(descr.required) |
+                                   frozenset(descr.optional))
+                self.emit(indent, "for k in {}:".format(var))
+                self.emit(indent + 1, "if k not in {}:".format(known))
+                self.emit(indent + 2, "return False")
+        elif isinstance(descr, (list, tuple, set)):
+            if len(descr) != 1:
+                raise ValueError("List in type description should be len 1")
+            inner = list(descr)[0]
+            container = 'set' if isinstance(descr, set) else '(list, tuple)'
+            self.emit(indent, "if not isinstance({}, {}):".format(var,
+                                                                  container))
+            self.emit(indent + 1, "return False")
+            if inner is not Any:
+                element = self.new_var('e')
+                self.emit(indent, "for {} in {}:".format(element, var))
+                self.gen(inner, element, indent + 1)
+        elif isinstance(descr, dict):
+            if len(descr) != 1:
+                raise ValueError("Dict in type description should be len 1")
+            key_descr, val_descr = descr.items()[0]
+            self.emit(indent, "if not isinstance({}, dict):".format(var))
+            self.emit(indent + 1, "return False")
+            if key_descr is not Any or val_descr is not Any:
+                key, val = self.new_var('k'), self.new_var('v')
+                self.emit(indent, "for {}, {} in {}.iteritems():".format(
+                    key, val, var))
+                self.gen(key_descr, key, indent + 1)
+                self.gen(val_descr, val, indent + 1)
+        elif descr is Any:
+            pass
+        elif descr is basestring:
+            self.emit(indent, "if not isinstance({}, basestring):".format(var))
+            self.emit(indent + 1, "return False")
+        elif descr in type_map:
+            self.emit(indent, "if type({}) is not {}:".format(
+                var, self.const(descr)))
+            self.emit(indent + 1, "return False")
+        else:
+            msg = "Unknown value in type description : {!r}".format(descr)
+            raise ValueError(msg)
+
+    def compile(self, descr):
+        self.emit(0, "def match(val):")
+        self.gen(descr, 'val', 1)
+        self.emit(1, "return True")
+        namespace = dict(self.consts)
+        exec "\n".join(self.lines) in namespace
+        return namespace['match']
+
+
+def descr_key(descr):
+    """Hashable representation of type description"""
+    if isinstance(descr, NoneOr):
+        return ('none_or', descr_key(descr.inner))
+    elif isinstance(descr, Struct):
+        return ('struct',
+                tuple(sorted((k, descr_key(v))
+                             for k, v in descr.required.items())),
+                tuple(sorted((k, descr_key(v))
+                             for k, v in descr.optional.items())),
+                descr.extra)
+    elif isinstance(descr, (list, tuple)):
+        return ('list',) + tuple(descr_key(item) for item in descr)
+    elif isinstance(descr, set):
+        return ('set',) + tuple(descr_key(item) for item in descr)
+    elif isinstance(descr, dict):
+        return ('dict',) + tuple(sorted((descr_key(k), descr_key(v))
+                                        for k, v in descr.items()))
+    return descr
+
+
+compiled_matchers = {}
+
+
+def compile_matcher(descr):
+    """Returns flat generated matcher for descr, compiled once"""
+    key = descr_key(descr)
+    matcher = compiled_matchers.get(key)
+    if matcher is None:
+        matcher = compiled_matchers[key] = CodeGen().compile(descr)
+    return matcher
+
+
+# ------------------------- error reporting ----------------------------------
+
+
+def find_error(descr, val, path):
+    """Returns (path, message) for first mismatch or None"""
+    def mismatch(expected):
+        return path, "expected {}, got {!r}".format(expected, val)
+
+    if isinstance(descr, NoneOr):
+        if val is None:
+            return None
+        return find_error(descr.inner, val, path)
+    elif isinstance(descr, Struct):
+        if not isinstance(val, dict):
+            return mismatch("dict")
+        for key, val_descr in sorted(descr.required.items()):
+            if key not in val:
+                return path, "required key {!r} is missing".format(key)
+            err = find_error(val_descr, val[key], path + [key])
+            if err is not None:
+                return err
+        for key, val_descr in sorted(descr.optional.items()):
+            if key in val:
+                err = find_error(val_descr, val[key], path + [key])
+                if err is not None:
+                    return err
+        if not descr.extra:
+            for key in val:
+                if key not in descr.required and key not in descr.optional:
+                    return path, "unknown key {!r}".format(key)
+    elif isinstance(descr, (list, tuple, set)):
+        inner = list(descr)[0]
+        container = set if isinstance(descr, set) else (list, tuple)
+        if not isinstance(val, container):
+            return mismatch("set" if container is set else "list")
+        for pos, element in enumerate(val):
+            err = find_error(inner, element, path + [pos])
+            if err is not None:
+                return err
+    elif isinstance(descr, dict):
+        key_descr, val_descr = descr.items()[0]
+        if not isinstance(val, dict):
+            return mismatch("dict")
+        for key, element in val.items():
+            err = find_error(key_descr, key, path + [key])
+            if err is not None:
+                return err[0], "key " + err[1]
+            err = find_error(val_descr, element, path + [key])
+            if err is not None:
+                return err
+    elif not descr2matcher(descr)(val):
+        return mismatch(getattr(descr, '__name__', descr))
+    return None
+
+
 def check(descr, val):
-    assert descr2matcher(descr)(val)
+    """Raise CheckError, if val doesn't match descr"""
+    if not compile_matcher(descr)(val):
+        err = find_error(descr, val, [])
+        if err is None:
+            raise CheckError([], "doesn't match {!r}".format(descr))
+        raise CheckError(*err)
 
 
 def test():
@@ -111,6 +358,37 @@ def test():
     assert descr2matcher({int: [str]})({1: []})
     assert not descr2matcher({int: [str]})({"1": []})
 
+    assert descr2matcher(NoneOr(int))(None)
+    assert descr2matcher(NoneOr(int))(1)
+    assert not descr2matcher(NoneOr(int))("1")
+    assert descr2matcher(basestring)(u"1")
+
+    struct = Struct({'name': str}, {'size': int}, extra=False)
+    assert descr2matcher(struct)({'name': "1"})
+    assert descr2matcher(struct)({'name': "1", 'size': 1})
+    assert not descr2matcher(struct)({'size': 1})
+    assert not descr2matcher(struct)({'name': "1", 'other': 1})
+
+    samples = [(int, 1), (int, "1"), ([int], [1, []]),
+               ({int: [str]}, {1: []}), ({int: [str]}, {"1": []}),
+               (NoneOr([int]), None),
+               (NoneOr([int]), [None]), ({str: Any}, {"1": [1]}),
+               (set([float]), set([1.1])), (struct, {'name': "1"}),
+               (struct, {'name': "1", 'size': "1"}),
+               ([struct], [{'name': "1", 'other': 1}])]
+
+    for descr, val in samples:
+        assert compile_matcher(descr)(val) == descr2matcher(descr)(val)
+
+    assert compile_matcher({int: [str]}) is compile_matcher({int: [str]})
+
+    try:
+        check({str: [Struct({'name': str})]}, {"eth0": [{'name': "1"}, {}]})
+    except CheckError as exc:
+        assert exc.path == ["eth0", 1]
+    else:
+        assert False, "CheckError expected"
+
 if __name__ == "__main__":
     test()
     print "All tests pass OK"
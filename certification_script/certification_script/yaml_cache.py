@@ -0,0 +1,66 @@
+import os
+import hashlib
+import cPickle
+
+from atomic_file import write_atomic
+
+
+DEFAULT_CACHE_DIR = os.path.expanduser('~/.cache/fuel_cert')
+
+
+def load_yaml(data):
+    # yaml is imported only on cache miss, it's slow to import
+    import yaml
+
+    # libyaml based loader is several times faster, if pyyaml
+    # is built with it
+    loader = getattr(yaml, 'CLoader', yaml.Loader)
+    return yaml.load(data, Loader=loader)
+
+
+def load_yaml_file(fname):
+    with open(fname) as fd:
+        return load_yaml(fd.read())
+
+
+class YAMLCache(object):
+    """Keeps parsed yaml files pickled on disk
+
+    Entry is reused while file path, mtime and size are unchanged
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.hits = 0
+        self.misses = 0
+
+    def cache_file(self, fname):
+        fstat = os.stat(fname)
+        key = "{}:{}:{}".format(os.path.abspath(fname),
+                                fstat.st_mtime, fstat.st_size)
+        return os.path.join(self.cache_dir,
+                            hashlib.md5(key).hexdigest() + '.pickle')
+
+    def load(self, fname):
+        cache_file = self.cache_file(fname)
+
+        try:
+            with open(cache_file, 'rb') as fd:
+                data = cPickle.load(fd)
+            self.hits += 1
+            return data
+        except Exception:
+            # missing, truncated or foreign entry, unpickling it may
+            # raise almost anything - parse yaml again
+            pass
+
+        self.misses += 1
+        data = load_yaml_file(fname)
+        self.store(cache_file, data)
+        return data
+
+    def store(self, cache_file, data):
+        write_atomic(cache_file,
+                     lambda fd: cPickle.dump(data, fd,
+                                             cPickle.HIGHEST_PROTOCOL),
+                     binary=True)